@@ -1,76 +1,1254 @@
 import os
 import numpy as np
 import pydicom
-import matplotlib.pyplot as plt
 import cv2
 from datetime import datetime
 import nibabel as nib
+import hashlib
+import json
+import threading
+import zlib
+import asyncio
+import io
+import sqlite3
+import functools
+import time
+import tracemalloc
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+# Etiquetas que se leen en la pasada de cabeceras (sin datos de píxel)
+ETIQUETAS_ESTUDIO = ("StudyDate", "StudyTime", "Modality", "StudyDescription", "SeriesTime")
+_ETIQUETAS_CABECERA = ETIQUETAS_ESTUDIO + (
+    "InstanceNumber", "ImagePositionPatient", "PixelSpacing", "SliceThickness",
+    "Rows", "Columns", "NumberOfFrames", "BitsAllocated", "PixelRepresentation", "SamplesPerPixel",
+    "WindowCenter", "WindowWidth", "RescaleSlope", "RescaleIntercept",
+    "StudyInstanceUID", "SeriesInstanceUID", "SeriesNumber", "SeriesDescription",
+)
+
+
+class _SpanNulo:
+    """Span que no registra nada; se usa cuando no hay ninguna Instrumentacion activa."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        return False
+
+    @property
+    def bytes(self):
+        return 0
+
+    @bytes.setter
+    def bytes(self, valor):
+        pass
+
+
+_SPAN_NULO = _SpanNulo()
+
+
+class _Span:
+    """Un tramo medido: duración, bytes procesados y pico de memoria (si se mide)."""
+
+    def __init__(self, registro, nombre, nbytes):
+        self.registro = registro
+        self.nombre = nombre
+        self.bytes = nbytes
+        self.pico = 0
+
+    def __enter__(self):
+        if self.registro.memoria:
+            self.registro._abrir(self)
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        duracion = time.perf_counter() - self.inicio
+        pico = self.registro._cerrar(self) if self.registro.memoria else 0
+        self.registro._acumular(self.nombre, duracion, self.bytes, pico)
+        return False
+
+
+class Instrumentacion:
+    """
+    Registro de tiempos, bytes y picos de memoria por etapa del pipeline.
+
+    Mientras está activa (with instr.activar(): ...), la carga, la lectura de cabeceras,
+    la decodificación, el apilado, la segmentación, la morfología, el redimensionado y
+    las escrituras PNG/NIfTI registran un span con su nombre. Los spans del mismo nombre
+    se acumulan (los de hilos paralelos suman su tiempo, por eso el total puede superar
+    al tiempo de reloj). Los que se ejecutan en otros procesos (backend='process') no se ven.
+
+    memoria: si es True se usa tracemalloc para medir el pico de memoria asignada dentro de
+             cada span (numpy incluido); hace más lenta la ejecución.
+    """
+
+    def __init__(self, memoria=False):
+        self.memoria = memoria
+        self.etapas = OrderedDict()
+        self.duracion_total = 0.0
+        self._lock = threading.Lock()
+        self._abiertos = []
+
+    def span(self, nombre, nbytes=0):
+        """Context manager que mide un tramo; el objeto devuelto permite fijar .bytes al final."""
+        return _Span(self, nombre, nbytes)
+
+    @contextmanager
+    def activar(self):
+        """Hace que las funciones del módulo registren sus spans en esta instancia."""
+        global _instrumentacion_activa
+        anterior = _instrumentacion_activa
+        inicio_tracemalloc = self.memoria and not tracemalloc.is_tracing()
+        if inicio_tracemalloc:
+            tracemalloc.start()
+        _instrumentacion_activa = self
+        inicio = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.duracion_total += time.perf_counter() - inicio
+            _instrumentacion_activa = anterior
+            if inicio_tracemalloc:
+                tracemalloc.stop()
+
+    def _abrir(self, span):
+        with self._lock:
+            # Antes de reiniciar el pico global, se lo anota a todos los spans abiertos
+            _, pico = tracemalloc.get_traced_memory()
+            for abierto in self._abiertos:
+                abierto.pico = max(abierto.pico, pico)
+            tracemalloc.reset_peak()
+            span.base, span.pico = tracemalloc.get_traced_memory()
+            self._abiertos.append(span)
+
+    def _cerrar(self, span):
+        with self._lock:
+            _, pico = tracemalloc.get_traced_memory()
+            self._abiertos.remove(span)
+            return max(span.pico, pico) - span.base
+
+    def _acumular(self, nombre, duracion, nbytes, pico):
+        with self._lock:
+            etapa = self.etapas.get(nombre)
+            if etapa is None:
+                etapa = self.etapas[nombre] = {"llamadas": 0, "tiempo_s": 0.0, "tiempo_max_s": 0.0,
+                                               "bytes": 0, "pico_memoria_bytes": 0}
+            etapa["llamadas"] += 1
+            etapa["tiempo_s"] += duracion
+            etapa["tiempo_max_s"] = max(etapa["tiempo_max_s"], duracion)
+            etapa["bytes"] += int(nbytes)
+            etapa["pico_memoria_bytes"] = max(etapa["pico_memoria_bytes"], int(pico))
+
+    def reporte(self):
+        """Devuelve el reporte estructurado (serializable a JSON) de todas las etapas."""
+        etapas = {}
+        for nombre, etapa in self.etapas.items():
+            datos = dict(etapa)
+            datos["mb_por_s"] = etapa["bytes"] / 1e6 / etapa["tiempo_s"] if etapa["tiempo_s"] > 0 else None
+            if not self.memoria:
+                del datos["pico_memoria_bytes"]
+            etapas[nombre] = datos
+        return {"duracion_total_s": self.duracion_total, "memoria_medida": self.memoria, "etapas": etapas}
+
+    def guardar_json(self, ruta):
+        """Guarda el reporte en un archivo JSON."""
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump(self.reporte(), f, indent=2, ensure_ascii=False)
+
+    def imprimir(self):
+        """Muestra el reporte como tabla en la consola."""
+        print(f"Duración total: {self.duracion_total:.3f}s")
+        for nombre, etapa in self.reporte()["etapas"].items():
+            linea = (f"  {nombre:<16} {etapa['llamadas']:6d} llamadas {etapa['tiempo_s']:9.3f}s "
+                     f"{etapa['bytes'] / 1e6:10.1f} MB")
+            if self.memoria:
+                linea += f"  pico {etapa['pico_memoria_bytes'] / 1e6:8.1f} MB"
+            print(linea)
+
+
+_instrumentacion_activa = None
+
+
+def _span(nombre, nbytes=0):
+    """Span de la Instrumentacion activa, o uno nulo (sin costo) si no hay ninguna."""
+    if _instrumentacion_activa is None:
+        return _SPAN_NULO
+    return _instrumentacion_activa.span(nombre, nbytes)
+
+
+def _guardar_imagen(ruta, imagen, parametros=None):
+    """cv2.imwrite (con sus parámetros de compresión) medido como etapa 'escritura_imagen'."""
+    with _span("escritura_imagen", imagen.nbytes):
+        return cv2.imwrite(ruta, imagen, parametros or [])
+
+
+def _primer_valor(valor):
+    """Devuelve el primer valor de un atributo DICOM multivalor como float (o None)."""
+    if valor is None or valor == "":
+        return None
+    if isinstance(valor, (list, tuple, pydicom.multival.MultiValue)):
+        valor = valor[0]
+    return float(valor)
+
+
+def _leer_cabecera(ruta, datos=None):
+    """
+    Lee solo las etiquetas necesarias de un archivo DICOM y las devuelve en un diccionario.
+    datos: bytes del archivo ya leídos (p. ej. por load_async); si se pasan no se abre 'ruta'.
+    """
+    fuente = io.BytesIO(datos) if datos is not None else ruta
+    with _span("cabecera", len(datos) if datos is not None else os.path.getsize(ruta)):
+        ds = pydicom.dcmread(fuente, stop_before_pixels=True, specific_tags=list(_ETIQUETAS_CABECERA))
+    posicion = getattr(ds, "ImagePositionPatient", None)
+    spacing = getattr(ds, "PixelSpacing", None)
+    espesor = getattr(ds, "SliceThickness", None)
+    forma, dtype = _forma_y_tipo(ds)
+    centro = _primer_valor(getattr(ds, "WindowCenter", None))
+    ancho = _primer_valor(getattr(ds, "WindowWidth", None))
+    pendiente = _primer_valor(getattr(ds, "RescaleSlope", None))
+    intercepto = _primer_valor(getattr(ds, "RescaleIntercept", None))
+    return {
+        "ruta": ruta,
+        "instancia": int(ds.InstanceNumber),
+        "posicion": tuple(float(v) for v in posicion) if posicion is not None else None,
+        "pixel_spacing": tuple(float(v) for v in spacing) if spacing is not None else None,
+        "slice_thickness": float(espesor) if espesor not in (None, "") else None,
+        "forma": forma,
+        "dtype": dtype,
+        "etiquetas": {t: getattr(ds, t, None) for t in ETIQUETAS_ESTUDIO},
+        "ventana": (centro, ancho) if centro is not None and ancho else None,
+        "rescale": (pendiente if pendiente else 1.0, intercepto or 0.0),
+        "sintaxis": _sintaxis_transferencia(ds),
+        "estudio_uid": str(getattr(ds, "StudyInstanceUID", "")) or None,
+        "serie_uid": str(getattr(ds, "SeriesInstanceUID", "")) or None,
+        "serie_numero": int(ds.SeriesNumber) if getattr(ds, "SeriesNumber", None) not in (None, "") else None,
+        "serie_descripcion": str(getattr(ds, "SeriesDescription", "")) or None,
+    }
+
+
+def _cabecera_a_json(cabecera):
+    """Serializa una cabecera de _leer_cabecera() a texto JSON."""
+    datos = dict(cabecera)
+    datos["dtype"] = cabecera["dtype"].str
+    datos["etiquetas"] = {k: (str(v) if v is not None else None) for k, v in cabecera["etiquetas"].items()}
+    return json.dumps(datos)
+
+
+def _cabecera_desde_json(texto):
+    """Inverso de _cabecera_a_json()."""
+    datos = json.loads(texto)
+    datos["dtype"] = np.dtype(datos["dtype"])
+    for clave in ("forma", "posicion", "pixel_spacing", "ventana", "rescale"):
+        if datos[clave] is not None:
+            datos[clave] = tuple(datos[clave])
+    return datos
+
+
+def _sintaxis_transferencia(ds):
+    """UID de la sintaxis de transferencia (de la meta-información del archivo) o None."""
+    meta = getattr(ds, "file_meta", None)
+    sintaxis = getattr(meta, "TransferSyntaxUID", None) if meta is not None else None
+    return str(sintaxis) if sintaxis else None
+
+
+# Plugins de decodificación de pydicom por sintaxis comprimida, del más rápido al más lento.
+# Solo se usan los que estén instalados; si no hay ninguno se usa ds.pixel_array tal cual.
+PREFERENCIA_DECODIFICADORES = {
+    pydicom.uid.JPEGBaseline8Bit: ("pylibjpeg", "gdcm", "pillow"),
+    pydicom.uid.JPEGExtended12Bit: ("pylibjpeg", "gdcm", "pillow"),
+    pydicom.uid.JPEGLossless: ("pylibjpeg", "gdcm"),
+    pydicom.uid.JPEGLosslessSV1: ("pylibjpeg", "gdcm"),
+    pydicom.uid.JPEGLSLossless: ("pyjpegls", "pylibjpeg", "gdcm"),
+    pydicom.uid.JPEGLSNearLossless: ("pyjpegls", "pylibjpeg", "gdcm"),
+    pydicom.uid.JPEG2000Lossless: ("pylibjpeg", "gdcm", "pillow"),
+    pydicom.uid.JPEG2000: ("pylibjpeg", "gdcm", "pillow"),
+    pydicom.uid.RLELossless: ("pylibjpeg", "gdcm", "pydicom"),
+}
+
+
+@functools.lru_cache(maxsize=None)
+def elegir_decodificador(sintaxis):
+    """
+    Devuelve el plugin de pydicom a usar para una sintaxis de transferencia.
+    '' significa decodificación por defecto (ds.pixel_array): sintaxis sin comprimir,
+    desconocidas o sin ningún plugin instalado.
+    """
+    if not sintaxis or not pydicom.uid.UID(sintaxis).is_compressed:
+        return ""
+    try:
+        disponibles = pydicom.pixels.get_decoder(sintaxis).available_plugins
+    except NotImplementedError:
+        return ""
+    for plugin in PREFERENCIA_DECODIFICADORES.get(sintaxis, ()):
+        if plugin in disponibles:
+            return plugin
+    return disponibles[0] if disponibles else ""
+
+
+def describir_decodificador(sintaxis):
+    """Texto legible con la sintaxis de transferencia y el decodificador elegido."""
+    nombre = pydicom.uid.UID(sintaxis).name if sintaxis else "desconocida"
+    return f"{nombre} -> {elegir_decodificador(sintaxis) or 'pydicom (por defecto)'}"
+
+
+# Valor de DicomLoader.decodificador cuando el plugin elegido falló y se usó ds.pixel_array
+DECODIFICADOR_RESPALDO = "pydicom (respaldo)"
+
+# Errores con los que pydicom indica que un plugin no pudo decodificar (o no está disponible)
+_ERRORES_DECODIFICADOR = (RuntimeError, ValueError, NotImplementedError, ImportError)
+
+
+def _decodificar_corte_con_backend(ruta, decodificador="", datos=None):
+    """
+    Lee un archivo DICOM completo y devuelve (matriz de píxeles, backend usado).
+    decodificador: plugin de pydicom (ver elegir_decodificador); si falla se usa ds.pixel_array
+                   y el backend devuelto es DECODIFICADOR_RESPALDO.
+    datos: bytes del archivo ya leídos; si se pasan no se abre 'ruta'.
+    """
+    def fuente():
+        return io.BytesIO(datos) if datos is not None else ruta
+
+    with _span("decodificacion") as span:
+        corte = None
+        usado = decodificador
+        if decodificador:
+            try:
+                corte = pydicom.pixels.pixel_array(fuente(), decoding_plugin=decodificador)
+            except _ERRORES_DECODIFICADOR:
+                usado = DECODIFICADOR_RESPALDO
+        if corte is None:
+            corte = pydicom.dcmread(fuente()).pixel_array
+        span.bytes = corte.nbytes
+    return corte, usado
+
+
+def _decodificar_corte(ruta, decodificador="", datos=None):
+    """Igual que _decodificar_corte_con_backend() pero devuelve solo la matriz de píxeles."""
+    return _decodificar_corte_con_backend(ruta, decodificador, datos)[0]
+
+
+def _forma_y_tipo(ds):
+    """
+    Calcula la forma y el tipo de dato de un corte a partir de Rows/Columns/BitsAllocated.
+    Los archivos multi-frame (NumberOfFrames > 1) dan cortes de forma (frames, filas, columnas).
+    """
+    bits = int(ds.BitsAllocated)
+    if bits == 1:
+        # pydicom desempaqueta los datos de 1 bit a uint8
+        dtype = np.dtype(np.uint8)
+    else:
+        signo = "i" if int(getattr(ds, "PixelRepresentation", 0)) == 1 else "u"
+        dtype = np.dtype(f"{signo}{bits // 8}")
+
+    forma = (int(ds.Rows), int(ds.Columns))
+    muestras = int(getattr(ds, "SamplesPerPixel", 1))
+    if muestras > 1:
+        forma += (muestras,)
+    frames = int(getattr(ds, "NumberOfFrames", None) or 1)
+    if frames > 1:
+        forma = (frames,) + forma
+    return forma, dtype
+
+
+def _colocar_corte(destino, corte):
+    """Copia un corte decodificado en su posición del volumen sin conversiones con pérdida."""
+    with _span("apilado", corte.nbytes):
+        np.copyto(destino, corte, casting="safe")
+
+
+def _pyplot():
+    """Importa matplotlib.pyplot solo cuando realmente se va a mostrar algo."""
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def mostrar_imagenes(paneles, figsize=None):
+    """
+    Muestra varias imágenes lado a lado con matplotlib.
+    paneles: lista de (imagen, título); las imágenes de 3 canales se muestran en color (RGB).
+    """
+    plt = _pyplot()
+    fig, axs = plt.subplots(1, len(paneles), figsize=figsize or (4 * len(paneles), 4), squeeze=False)
+    for ax, (imagen, titulo) in zip(axs[0], paneles):
+        if imagen.ndim == 3:
+            ax.imshow(imagen)
+        else:
+            ax.imshow(imagen, cmap='gray')
+        ax.set_title(titulo)
+        ax.axis('off')
+    plt.tight_layout()
+    plt.show()
+
+
+def _elegir_serie(cabeceras, serie_uid=None):
+    """Filtra las cabeceras de una sola serie (la pedida o, si hay varias, la de más archivos)."""
+    grupos = OrderedDict()
+    for cabecera in cabeceras:
+        grupos.setdefault(cabecera.get("serie_uid"), []).append(cabecera)
+
+    if serie_uid is not None:
+        if serie_uid not in grupos:
+            raise ValueError(f"La serie {serie_uid} no está en la carpeta.")
+        return grupos[serie_uid]
+    if len(grupos) == 1:
+        return cabeceras
+
+    uid, elegidas = max(grupos.items(), key=lambda g: len(g[1]))
+    print(f"Aviso: la carpeta contiene {len(grupos)} series; se usa {uid} ({len(elegidas)} archivos). "
+          "Indique serie_uid para elegir otra.")
+    return elegidas
+
+
+class IndiceSerie:
+    """
+    Índice ordenado de una serie DICOM construido en una sola pasada de cabeceras.
+
+    Guarda las rutas ordenadas por InstanceNumber, las posiciones, el espaciado,
+    la forma/tipo de los cortes y las etiquetas del estudio, para que el cargador,
+    el estudio y el exportador NIfTI no tengan que volver a leer los archivos.
+    """
+
+    def __init__(self, folder_path, mapa=map, serie_uid=None):
+        """
+        mapa: función tipo map() usada para leer las cabeceras (p. ej. pool.map).
+        serie_uid: SeriesInstanceUID a usar si la carpeta mezcla varias series; por defecto
+                   se toma la serie con más archivos (avisando), nunca se mezclan cortes.
+        """
+        archivos = [f for f in os.listdir(folder_path) if f.lower().endswith('.dcm')]
+        if not archivos:
+            raise ValueError("No se encontraron archivos DICOM en la carpeta.")
+
+        cabeceras = list(mapa(_leer_cabecera, [os.path.join(folder_path, f) for f in archivos]))
+        self._asignar(folder_path, _elegir_serie(cabeceras, serie_uid))
+
+    @classmethod
+    def desde_cabeceras(cls, folder_path, cabeceras):
+        """Construye el índice con cabeceras ya leídas (p. ej. desde un CatalogoDicom)."""
+        indice = cls.__new__(cls)
+        indice._asignar(folder_path, list(cabeceras))
+        return indice
+
+    def _asignar(self, folder_path, cabeceras):
+        self.folder_path = folder_path
+        # Orden estable por InstanceNumber (eje Z)
+        cabeceras.sort(key=lambda c: c["instancia"])
+
+        primera = cabeceras[0]
+        self.rutas = [c["ruta"] for c in cabeceras]
+        self.instancias = [c["instancia"] for c in cabeceras]
+        self.posiciones = [c["posicion"] for c in cabeceras]
+        self.forma = primera["forma"]
+        self.dtype = primera["dtype"]
+        self.pixel_spacing = primera["pixel_spacing"]
+        self.slice_thickness = primera["slice_thickness"]
+        self.etiquetas = primera["etiquetas"]
+        self.ventana = primera["ventana"]  # (WindowCenter, WindowWidth) o None
+        self.rescale = primera["rescale"]  # (RescaleSlope, RescaleIntercept)
+        self.sintaxis = primera["sintaxis"]  # TransferSyntaxUID
+        self.estudio_uid = primera.get("estudio_uid")
+        self.serie_uid = primera.get("serie_uid")
+
+    def __len__(self):
+        return len(self.rutas)
+
+    def metadatos(self, i):
+        """Metadatos del corte i (en el orden del índice) como diccionario."""
+        return {
+            "ruta": self.rutas[i],
+            "instancia": self.instancias[i],
+            "posicion": self.posiciones[i],
+            "pixel_spacing": self.pixel_spacing,
+            "slice_thickness": self.slice_thickness,
+            "ventana": self.ventana,
+            "rescale": self.rescale,
+        }
+
+    def orden_por_posicion(self):
+        """Devuelve la permutación que ordena los cortes por ImagePositionPatient (eje Z)."""
+        return sorted(range(len(self)),
+                      key=lambda i: self.posiciones[i][2] if self.posiciones[i] is not None else 0)
+
+    def a_dict(self):
+        """Devuelve el índice como diccionario serializable en JSON."""
+        return {
+            "folder_path": self.folder_path,
+            "rutas": self.rutas,
+            "instancias": self.instancias,
+            "posiciones": self.posiciones,
+            "forma": list(self.forma),
+            "dtype": self.dtype.str,
+            "pixel_spacing": self.pixel_spacing,
+            "slice_thickness": self.slice_thickness,
+            "etiquetas": {k: (str(v) if v is not None else None) for k, v in self.etiquetas.items()},
+            "ventana": self.ventana,
+            "rescale": self.rescale,
+            "sintaxis": self.sintaxis,
+            "estudio_uid": self.estudio_uid,
+            "serie_uid": self.serie_uid,
+        }
+
+    @classmethod
+    def desde_dict(cls, datos):
+        """Reconstruye un índice guardado con a_dict() sin volver a leer las cabeceras."""
+        indice = cls.__new__(cls)
+        indice.folder_path = datos["folder_path"]
+        indice.rutas = datos["rutas"]
+        indice.instancias = datos["instancias"]
+        indice.posiciones = [tuple(p) if p is not None else None for p in datos["posiciones"]]
+        indice.forma = tuple(datos["forma"])
+        indice.dtype = np.dtype(datos["dtype"])
+        indice.pixel_spacing = tuple(datos["pixel_spacing"]) if datos["pixel_spacing"] is not None else None
+        indice.slice_thickness = datos["slice_thickness"]
+        indice.etiquetas = datos["etiquetas"]
+        indice.ventana = tuple(datos["ventana"]) if datos.get("ventana") else None
+        indice.rescale = tuple(datos.get("rescale") or (1.0, 0.0))
+        indice.sintaxis = datos.get("sintaxis")
+        indice.estudio_uid = datos.get("estudio_uid")
+        indice.serie_uid = datos.get("serie_uid")
+        return indice
+
+    @property
+    def decodificador(self):
+        """Plugin de pydicom elegido para la sintaxis de transferencia de la serie."""
+        return elegir_decodificador(self.sintaxis)
+
+    @property
+    def comprimida(self):
+        return bool(self.sintaxis) and pydicom.uid.UID(self.sintaxis).is_compressed
+
+
+class Geometria:
+    """
+    Geometría del volumen (cortes, filas, columnas): espaciado en mm de cada eje y espesor de corte.
+    El espaciado entre cortes se mide con ImagePositionPatient (no con SliceThickness, que
+    puede no coincidir cuando hay solape o separación entre cortes).
+    """
+
+    def __init__(self, espaciado=(1.0, 1.0, 1.0), espesor=None):
+        self.espaciado = tuple(float(e) for e in espaciado)
+        self.espesor = float(espesor) if espesor is not None else self.espaciado[0]
+
+    @classmethod
+    def desde_indice(cls, indice):
+        """Construye la geometría a partir del IndiceSerie (sin leer archivos)."""
+        fila, columna = indice.pixel_spacing or (1.0, 1.0)
+        dz = None
+        posiciones = [p for p in indice.posiciones if p is not None]
+        if len(posiciones) > 1:
+            distancias = np.linalg.norm(np.diff(np.array(posiciones), axis=0), axis=1)
+            distancias = distancias[distancias > 0]
+            if len(distancias):
+                dz = float(np.median(distancias))
+        if dz is None:
+            dz = indice.slice_thickness or 1.0
+        return cls((dz, fila, columna), indice.slice_thickness)
+
+    def espaciado_corte(self, tipo):
+        """(mm entre filas, mm entre columnas) del corte del tipo dado."""
+        dz, fila, columna = self.espaciado
+        espaciados = {"axial": (fila, columna), "coronal": (dz, columna), "sagital": (dz, fila)}
+        if tipo not in espaciados:
+            raise ValueError("Tipo de corte no válido")
+        return espaciados[tipo]
+
+
+class CacheVolumenes:
+    """
+    Caché persistente en disco de volúmenes ya ensamblados.
+
+    Cada entrada es un .npy (abierto luego con memoria mapeada) más un .json con
+    el IndiceSerie. La clave depende de la carpeta y de los nombres, tamaños y
+    fechas de modificación de sus archivos .dcm, así que cualquier cambio en la
+    serie invalida la entrada. Cuando se supera 'max_bytes' se eliminan las
+    entradas usadas hace más tiempo (LRU).
+    """
+
+    def __init__(self, directorio=None, max_bytes=2 * 1024**3):
+        if directorio is None:
+            directorio = os.path.join(os.path.expanduser("~"), ".cache", "dicom_volumenes")
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        os.makedirs(self.directorio, exist_ok=True)
+
+    def clave(self, folder_path, serie_uid=None):
+        """
+        Calcula la clave de la serie a partir de la lista de archivos, tamaños y mtimes
+        (y del SeriesInstanceUID elegido, si la carpeta mezcla varias series).
+        """
+        h = hashlib.sha1(os.path.abspath(folder_path).encode("utf-8"))
+        if serie_uid is not None:
+            h.update(f"\0{serie_uid}".encode("utf-8"))
+        with os.scandir(folder_path) as entradas:
+            archivos = sorted((e.name, e.stat()) for e in entradas
+                              if e.is_file() and e.name.lower().endswith('.dcm'))
+        for nombre, st in archivos:
+            h.update(f"{nombre}\0{st.st_size}\0{st.st_mtime_ns}\n".encode("utf-8"))
+        return h.hexdigest()
+
+    def _rutas(self, clave):
+        base = os.path.join(self.directorio, clave)
+        return base + ".npy", base + ".json"
+
+    def obtener(self, clave):
+        """Devuelve (volumen mapeado en memoria de solo lectura, IndiceSerie) o None si no existe."""
+        ruta_npy, ruta_json = self._rutas(clave)
+        try:
+            with open(ruta_json, encoding="utf-8") as f:
+                indice = IndiceSerie.desde_dict(json.load(f))
+            volume = np.load(ruta_npy, mmap_mode="r")
+        except (OSError, ValueError, KeyError):
+            return None
+
+        # Marcar la entrada como usada recientemente para el LRU
+        os.utime(ruta_npy)
+        return volume, indice
+
+    def guardar(self, clave, volume, indice):
+        """Guarda el volumen y su índice de forma atómica y aplica el límite de tamaño."""
+        ruta_npy, ruta_json = self._rutas(clave)
+        temporal = f"{ruta_npy}.{os.getpid()}.tmp"
+        with open(temporal, "wb") as f:
+            np.save(f, np.ascontiguousarray(volume))
+        os.replace(temporal, ruta_npy)
+
+        temporal = f"{ruta_json}.{os.getpid()}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(indice.a_dict(), f)
+        os.replace(temporal, ruta_json)
+
+        self._desalojar(conservar=clave)
+
+    def _desalojar(self, conservar=None):
+        """Elimina las entradas menos usadas hasta quedar por debajo de max_bytes."""
+        entradas = []
+        total = 0
+        for nombre in os.listdir(self.directorio):
+            if not nombre.endswith(".npy"):
+                continue
+            clave = nombre[:-4]
+            try:
+                st = os.stat(os.path.join(self.directorio, nombre))
+            except OSError:
+                continue
+            entradas.append((st.st_mtime, st.st_size, clave))
+            total += st.st_size
+
+        for _, tamano, clave in sorted(entradas):
+            if total <= self.max_bytes:
+                break
+            if clave == conservar:
+                continue
+            for ruta in self._rutas(clave):
+                try:
+                    os.remove(ruta)
+                except OSError:
+                    pass
+            total -= tamano
+
+
+class CatalogoDicom:
+    """
+    Catálogo persistente (SQLite) de los archivos DICOM de uno o varios árboles de carpetas.
+
+    indexar() recorre el árbol una vez y guarda por archivo su ruta, tamaño, mtime,
+    StudyInstanceUID/SeriesInstanceUID y la cabecera ya leída; en las siguientes pasadas
+    solo se vuelven a leer los archivos nuevos o modificados y se borran los que ya no
+    existen. Abrir una serie (indice_serie) es entonces una consulta, sin recorrer la
+    carpeta ni leer ningún archivo.
+    """
+
+    def __init__(self, ruta_db=None):
+        if ruta_db is None:
+            directorio = os.path.join(os.path.expanduser("~"), ".cache")
+            os.makedirs(directorio, exist_ok=True)
+            ruta_db = os.path.join(directorio, "dicom_catalogo.sqlite")
+        self.ruta_db = ruta_db
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(ruta_db, check_same_thread=False)
+        with self._conexion:
+            self._conexion.execute("""
+                CREATE TABLE IF NOT EXISTS archivos (
+                    ruta TEXT PRIMARY KEY,
+                    carpeta TEXT NOT NULL,
+                    tamano INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    estudio_uid TEXT,
+                    serie_uid TEXT,
+                    instancia INTEGER,
+                    cabecera TEXT NOT NULL
+                )""")
+            self._conexion.execute("CREATE INDEX IF NOT EXISTS idx_serie ON archivos (serie_uid)")
+            self._conexion.execute("CREATE INDEX IF NOT EXISTS idx_carpeta ON archivos (carpeta)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        self.cerrar()
+
+    def cerrar(self):
+        self._conexion.close()
+
+    def indexar(self, raiz, workers=None):
+        """
+        Actualiza el catálogo con los .dcm de 'raiz' (recursivo) y devuelve un resumen
+        {'nuevos', 'actualizados', 'eliminados', 'sin_cambios', 'errores'}.
+        workers: hilos para leer las cabeceras nuevas o modificadas.
+        """
+        raiz = os.path.abspath(raiz)
+        en_disco = {}
+        for carpeta, _, archivos in os.walk(raiz):
+            for nombre in archivos:
+                if nombre.lower().endswith('.dcm'):
+                    ruta = os.path.join(carpeta, nombre)
+                    try:
+                        st = os.stat(ruta)
+                    except OSError:
+                        continue
+                    en_disco[ruta] = (st.st_size, st.st_mtime_ns)
+
+        prefijo = raiz.rstrip(os.sep) + os.sep
+        with self._lock:
+            guardados = {ruta: (tamano, mtime) for ruta, tamano, mtime in self._conexion.execute(
+                "SELECT ruta, tamano, mtime_ns FROM archivos WHERE substr(ruta, 1, ?) = ?",
+                (len(prefijo), prefijo))}
+
+        pendientes = [r for r, firma in en_disco.items() if guardados.get(r) != firma]
+        eliminados = [r for r in guardados if r not in en_disco]
+
+        def _leer(ruta):
+            try:
+                return ruta, _leer_cabecera(ruta)
+            except Exception:
+                return ruta, None
+
+        if workers and workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                leidas = list(pool.map(_leer, pendientes))
+        else:
+            leidas = [_leer(r) for r in pendientes]
+
+        filas = [(ruta, os.path.dirname(ruta), *en_disco[ruta], c["estudio_uid"], c["serie_uid"],
+                  c["instancia"], _cabecera_a_json(c)) for ruta, c in leidas if c is not None]
+        errores = [ruta for ruta, c in leidas if c is None]
+
+        with self._lock, self._conexion:
+            self._conexion.executemany("DELETE FROM archivos WHERE ruta = ?",
+                                       [(r,) for r in eliminados + errores])
+            self._conexion.executemany("INSERT OR REPLACE INTO archivos VALUES (?, ?, ?, ?, ?, ?, ?, ?)", filas)
+
+        nuevos = sum(fila[0] not in guardados for fila in filas)
+        return {"nuevos": nuevos, "actualizados": len(filas) - nuevos, "eliminados": len(eliminados),
+                "sin_cambios": len(en_disco) - len(pendientes), "errores": len(errores)}
+
+    def series(self, carpeta=None):
+        """
+        Lista las series del catálogo (opcionalmente solo las de 'carpeta' y sus subcarpetas)
+        como diccionarios con estudio_uid, serie_uid, carpeta, archivos, modalidad y descripción.
+        Una serie copiada en varias carpetas aparece una vez por carpeta.
+        """
+        consulta = ("SELECT estudio_uid, serie_uid, carpeta, COUNT(*), MIN(ruta) "
+                    "FROM archivos {} GROUP BY estudio_uid, serie_uid, carpeta ORDER BY estudio_uid, MIN(ruta)")
+        parametros = ()
+        if carpeta is not None:
+            prefijo = os.path.abspath(carpeta).rstrip(os.sep)
+            consulta = consulta.format("WHERE carpeta = ? OR substr(carpeta, 1, ?) = ?")
+            parametros = (prefijo, len(prefijo) + 1, prefijo + os.sep)
+        else:
+            consulta = consulta.format("")
+
+        resultado = []
+        with self._lock:
+            filas = self._conexion.execute(consulta, parametros).fetchall()
+            for estudio_uid, serie_uid, carpeta_serie, n, primera in filas:
+                (texto,) = self._conexion.execute(
+                    "SELECT cabecera FROM archivos WHERE ruta = ?", (primera,)).fetchone()
+                cabecera = json.loads(texto)
+                resultado.append({
+                    "estudio_uid": estudio_uid,
+                    "serie_uid": serie_uid,
+                    "carpeta": carpeta_serie,
+                    "archivos": n,
+                    "modalidad": cabecera["etiquetas"].get("Modality"),
+                    "serie_numero": cabecera.get("serie_numero"),
+                    "descripcion": cabecera.get("serie_descripcion"),
+                })
+        return resultado
+
+    def indice_serie(self, serie_uid=None, carpeta=None):
+        """
+        Devuelve el IndiceSerie de una serie sin leer ningún archivo.
+        serie_uid: la serie a abrir; si es None se usa la serie con más archivos de 'carpeta'.
+        carpeta: si se indica, solo se usan los archivos de esa carpeta. Sin ella, si la serie
+                 está copiada en varias carpetas se usa la que tiene más archivos (con un aviso):
+                 las copias nunca se mezclan en un mismo índice.
+        """
+        if serie_uid is None and carpeta is None:
+            raise ValueError("Indique la serie (serie_uid) o la carpeta a buscar en el catálogo.")
+
+        consulta = "SELECT carpeta, cabecera, serie_uid FROM archivos WHERE "
+        if carpeta is not None:
+            consulta, parametros = consulta + "carpeta = ?", (os.path.abspath(carpeta),)
+        else:
+            consulta, parametros = consulta + "serie_uid IS ?", (serie_uid,)
+        with self._lock:
+            filas = self._conexion.execute(consulta, parametros).fetchall()
+
+        if carpeta is not None:
+            grupos = OrderedDict()
+            for fila in filas:
+                grupos.setdefault(fila[2], []).append(fila)
+            if serie_uid is None and grupos:
+                serie_uid = max(grupos, key=lambda uid: len(grupos[uid]))
+            filas = grupos.get(serie_uid, [])
+        if not filas:
+            raise ValueError(f"La serie {serie_uid or ''} no está en el catálogo ({carpeta or 'sin carpeta'}).")
+
+        por_carpeta = OrderedDict()
+        for fila in sorted(filas):
+            por_carpeta.setdefault(fila[0], []).append(fila)
+        folder_path, filas = max(por_carpeta.items(), key=lambda g: len(g[1]))
+        if len(por_carpeta) > 1:
+            print(f"Aviso: la serie {serie_uid} está en {len(por_carpeta)} carpetas; se usa {folder_path} "
+                  f"({len(filas)} archivos). Indique la carpeta para elegir otra.")
+        return IndiceSerie.desde_cabeceras(folder_path, [_cabecera_desde_json(t) for _, t, _ in filas])
+
+
+class VolumenPerezoso:
+    """
+    Volumen de solo lectura que decodifica los cortes axiales bajo demanda.
+
+    Se indexa como un ndarray (cortes, filas, columnas), de modo que
+    GestionImagenes.obtener_corte funciona igual que con un volumen en memoria.
+    Solo se mantienen en RAM los últimos 'max_cortes' cortes decodificados (LRU).
+    Los cortes coronales y sagitales recorren todos los cortes axiales, pero la
+    memoria usada sigue siendo la de un corte de salida más la caché.
+    """
+
+    def __init__(self, indice, max_cortes=16):
+        self.indice = indice
+        self.max_cortes = max_cortes
+        self.shape = (len(indice),) + tuple(indice.forma)
+        self.dtype = indice.dtype
+        self.ndim = len(self.shape)
+        self._cortes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self):
+        """Tamaño en bytes del volumen completo (como ndarray.nbytes), sin decodificarlo."""
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def _corte(self, i):
+        """Devuelve el corte axial i, decodificándolo solo si no está en la caché."""
+        i = range(len(self))[i]  # normaliza negativos y valida el rango
+        with self._lock:
+            if i in self._cortes:
+                self._cortes.move_to_end(i)
+                return self._cortes[i]
+
+        corte = _decodificar_corte(self.indice.rutas[i], self.indice.decodificador)
+        corte.flags.writeable = False
+
+        with self._lock:
+            self._cortes[i] = corte
+            while len(self._cortes) > self.max_cortes:
+                self._cortes.popitem(last=False)
+        return corte
+
+    def __getitem__(self, clave):
+        if not isinstance(clave, tuple):
+            clave = (clave,)
+        primero, resto = clave[0], clave[1:]
+
+        if isinstance(primero, (int, np.integer)):
+            return self._corte(int(primero))[resto]
+
+        # Varios cortes axiales: se arma la salida corte a corte
+        indices = np.arange(len(self))[primero]
+        vacio = np.empty((0,) + self.shape[1:], dtype=self.dtype)[(slice(None),) + resto]
+        salida = np.empty((len(indices),) + vacio.shape[1:], dtype=self.dtype)
+        for k, i in enumerate(indices):
+            salida[k] = self._corte(int(i))[resto]
+        return salida
+
+    def __array__(self, dtype=None, copy=None):
+        volumen = self[:]
+        return volumen if dtype is None else volumen.astype(dtype, copy=False)
+
+
+class LectorArchivos:
+    """
+    Lector asíncrono de bytes de archivos para DicomLoader.load_async.
+
+    Cada lectura bloqueante se hace en un pool propio de 'hilos' hilos.
+    latencia: segundos de espera añadidos a cada apertura, para reproducir localmente
+              un almacenamiento de alta latencia (la espera ocupa el hilo, como un open() real).
+    """
+
+    def __init__(self, hilos=32, latencia=0.0):
+        self.latencia = latencia
+        self._pool = ThreadPoolExecutor(max_workers=hilos)
+
+    def _leer(self, ruta):
+        if self.latencia:
+            time.sleep(self.latencia)
+        with open(ruta, "rb") as f:
+            return f.read()
+
+    async def __call__(self, ruta):
+        return await asyncio.get_running_loop().run_in_executor(self._pool, self._leer, ruta)
+
+    def cerrar(self):
+        self._pool.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        self.cerrar()
 
 
 class DicomLoader:
-    def __init__(self, folder_path):
+    def __init__(self, folder_path=None, workers=None, backend="thread", cache=None,
+                 serie_uid=None, catalogo=None):
+        """
+        workers: número de hilos/procesos para la carga paralela (1 = carga serial; None = serial
+                 salvo en series comprimidas, que se decodifican con un hilo por CPU).
+        backend: 'thread' o 'process'.
+        cache: CacheVolumenes opcional; si la serie no cambió, load() devuelve el volumen
+               guardado mapeado en memoria (solo lectura) sin decodificar ningún archivo.
+        serie_uid: SeriesInstanceUID a cargar cuando la carpeta (o el catálogo) tiene varias series.
+        catalogo: CatalogoDicom opcional; el índice de la serie se toma de él en lugar de
+                  recorrer la carpeta y leer las cabeceras (se indexa la carpeta si falta).
+        """
+        if backend not in ("thread", "process"):
+            raise ValueError("Backend no válido. Usa: 'thread' o 'process'.")
+        if folder_path is None and (catalogo is None or serie_uid is None):
+            raise ValueError("Indique la carpeta DICOM o una serie (serie_uid) de un catálogo.")
         self.folder_path = folder_path
+        self.serie_uid = serie_uid
+        self.catalogo = catalogo
+        self.workers = workers
+        self.backend = backend
+        self.cache = cache
         self.slices = []
         self.volume = None
+        self.indice = None
+        self.geometria = None
+        # Backend que decodificó la última carga: plugin de pydicom, '' (por defecto) o
+        # DECODIFICADOR_RESPALDO si el plugin elegido falló en algún corte
+        self.decodificador = None
 
-    def load(self):
-        # Leer todos los archivos DICOM en la carpeta
-        files = [f for f in os.listdir(self.folder_path) if f.lower().endswith('.dcm')]
-        datasets = [pydicom.dcmread(os.path.join(self.folder_path, f)) for f in files]
-
-        # Ordenar por posición (eje Z)
-        datasets.sort(key=lambda x: int(x.InstanceNumber))
-
-        # Crear el volumen 3D
-        self.volume = np.stack([d.pixel_array for d in datasets])
+    def load(self, perezoso=False):
+        """
+        Carga la serie como volumen (cortes, filas, columnas).
+        perezoso: si es True solo se leen las cabeceras y se devuelve un VolumenPerezoso
+                  (o el volumen de la caché mapeado en memoria, que ya es perezoso).
+        """
+        with _span("carga") as span:
+            volume = self._load(perezoso)
+            span.bytes = volume.nbytes if isinstance(volume, np.ndarray) else 0
+        return volume
+
+    def _indice(self, mapa=map):
+        """Índice de la serie: del catálogo si hay uno, o leyendo las cabeceras de la carpeta."""
+        if self.catalogo is None:
+            return IndiceSerie(self.folder_path, mapa, self.serie_uid)
+        try:
+            return self.catalogo.indice_serie(self.serie_uid, self.folder_path)
+        except ValueError:
+            if self.folder_path is None:
+                raise
+            self.catalogo.indexar(self.folder_path)
+            return self.catalogo.indice_serie(self.serie_uid, self.folder_path)
+
+    def _desde_cache(self):
+        """
+        Resuelve la carpeta (si la serie viene de un catálogo) y busca la serie en la caché.
+        Devuelve (índice ya resuelto o None, clave de caché o None, volumen de la caché o None).
+        """
+        indice = None
+        if self.folder_path is None:
+            indice = self._indice()
+            self.folder_path = indice.folder_path
+
+        clave = None
+        if self.cache is not None:
+            clave = self.cache.clave(self.folder_path, self.serie_uid)
+            guardado = self.cache.obtener(clave)
+            if guardado is not None:
+                self.volume, self.indice = guardado
+                self.geometria = Geometria.desde_indice(self.indice)
+                self.decodificador = None
+                print(f"Volumen cargado desde caché con forma: {self.volume.shape}")
+                return indice, clave, self.volume
+        return indice, clave, None
+
+    def _terminar_carga(self, clave, usados):
+        """
+        Completa geometría y decodificador, guarda en la caché y reporta la carga.
+        usados: backend con el que se decodificó cada corte.
+        """
+        self.geometria = Geometria.desde_indice(self.indice)
+        self._registrar_decodificador(usados)
+        if clave is not None:
+            self.cache.guardar(clave, self.volume, self.indice)
         print(f"Volumen cargado con forma: {self.volume.shape}")
+        if self.indice.comprimida:
+            print(f"Sintaxis de transferencia: {describir_decodificador(self.indice.sintaxis)}")
+
+    def _registrar_decodificador(self, usados):
+        """Guarda en self.decodificador el backend que realmente decodificó la serie y avisa si hubo respaldo."""
+        fallidos = sum(u == DECODIFICADOR_RESPALDO for u in usados)
+        if fallidos:
+            print(f"Aviso: el decodificador '{self.indice.decodificador}' falló en {fallidos} de "
+                  f"{len(usados)} cortes; se usó {DECODIFICADOR_RESPALDO}.")
+            self.decodificador = DECODIFICADOR_RESPALDO
+        else:
+            self.decodificador = self.indice.decodificador
+
+    def _load(self, perezoso):
+        indice, clave, guardado = self._desde_cache()
+        if guardado is not None:
+            return guardado
+
+        if perezoso:
+            self.indice = indice or self._indice()
+            self.volume = VolumenPerezoso(self.indice)
+            self.geometria = Geometria.desde_indice(self.indice)
+            self.decodificador = self.indice.decodificador
+            print(f"Volumen perezoso preparado con forma: {self.volume.shape}")
+            return self.volume
+
+        if self.workers and self.workers > 1:
+            self.volume, usados = self._load_paralelo(self.workers, indice)
+        else:
+            # Pasada de cabeceras: ordena la serie sin decodificar píxeles
+            self.indice = indice or self._indice()
+            cpus = os.cpu_count() or 1
+            if self.workers is None and self.indice.comprimida and cpus > 1:
+                # Los decodificadores JPEG/JPEG 2000/RLE liberan el GIL: un hilo por CPU
+                self.volume, usados = self._load_paralelo(cpus, self.indice)
+            else:
+                self.volume, usados = self._load_serial()
+
+        self._terminar_carga(clave, usados)
         return self.volume
-    
-    def mostrar_cortes(self):
-        
-      """Muestra los tres cortes principales del volumen"""
-      if self.volume is None:
-          raise ValueError("Primero debes cargar los datos DICOM con el método load().")
 
-      z, y, x = np.array(self.volume.shape) // 2  # posiciones centrales
+    async def load_async(self, max_en_vuelo=64, lector=None):
+        """
+        Versión asíncrona de load() para almacenamiento de alta latencia (p. ej. montado en red).
+
+        Hasta 'max_en_vuelo' archivos se leen a la vez (solo bytes, sin interpretar) y su
+        decodificación se hace en un pool de hilos de 'workers' hilos (por defecto uno por CPU).
+        Con un catálogo el índice ya se conoce y cada corte se decodifica en cuanto llegan sus
+        bytes; sin él, primero se interpretan las cabeceras de los bytes leídos para ordenar la serie.
+        lector: función async (ruta) -> bytes; por defecto un LectorArchivos con 'max_en_vuelo' hilos.
+        """
+        propio = lector is None
+        if propio:
+            lector = LectorArchivos(hilos=max_en_vuelo)
+        try:
+            with _span("carga") as span:
+                indice, clave, guardado = await asyncio.to_thread(self._desde_cache)
+                if guardado is not None:
+                    return guardado
+
+                workers = self.workers or os.cpu_count() or 1
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    usados = await self._load_async(indice, lector, asyncio.Semaphore(max_en_vuelo), pool)
+                await asyncio.to_thread(self._terminar_carga, clave, usados)
+                span.bytes = self.volume.nbytes
+            return self.volume
+        finally:
+            if propio:
+                lector.cerrar()
+
+    async def _load_async(self, indice, lector, semaforo, pool):
+        loop = asyncio.get_running_loop()
+
+        async def _leer(ruta):
+            async with semaforo:
+                return await lector(ruta)
+
+        def _decodificar_en(volume, i, datos):
+            corte, usado = _decodificar_corte_con_backend(self.indice.rutas[i], self.indice.decodificador, datos)
+            _colocar_corte(volume[i], corte)
+            return usado
+
+        if indice is None and self.catalogo is not None:
+            indice = await asyncio.to_thread(self._indice)
+
+        if indice is not None:
+            # Índice conocido: lectura y decodificación solapadas, corte a corte
+            self.indice = indice
+            volume = self._reservar_volumen()
+
+            async def _leer_y_decodificar(i):
+                datos = await _leer(indice.rutas[i])
+                return await loop.run_in_executor(pool, _decodificar_en, volume, i, datos)
+
+            usados = await asyncio.gather(*(_leer_y_decodificar(i) for i in range(len(indice))))
+        else:
+            archivos = await asyncio.to_thread(os.listdir, self.folder_path)
+            rutas = [os.path.join(self.folder_path, f) for f in archivos if f.lower().endswith('.dcm')]
+            if not rutas:
+                raise ValueError("No se encontraron archivos DICOM en la carpeta.")
 
-      fig, axs = plt.subplots(1, 3, figsize=(12, 4))
+            async def _leer_con_cabecera(ruta):
+                datos = await _leer(ruta)
+                return await loop.run_in_executor(pool, _leer_cabecera, ruta, datos), datos
 
-      # Corte transversal (XY)
-      axs[0].imshow(self.volume[z, :, :], cmap='gray')
-      axs[0].set_title('Transversal (XY)')
-      axs[0].axis('off')
+            leidos = await asyncio.gather(*(_leer_con_cabecera(r) for r in rutas))
+            cabeceras = _elegir_serie([c for c, _ in leidos], self.serie_uid)
+            self.indice = IndiceSerie.desde_cabeceras(self.folder_path, cabeceras)
+            por_ruta = {c["ruta"]: datos for c, datos in leidos}
+            del leidos
+            volume = self._reservar_volumen()
 
-      # Corte coronal (XZ)
-      axs[1].imshow(self.volume[:, y, :], cmap='gray')
-      axs[1].set_title('Coronal (XZ)')
-      axs[1].axis('off')
+            usados = await asyncio.gather(*(loop.run_in_executor(pool, _decodificar_en, volume, i, por_ruta.pop(ruta))
+                                            for i, ruta in enumerate(self.indice.rutas)))
 
-      # Corte sagital (YZ)
-      axs[2].imshow(self.volume[:, :, x], cmap='gray')
-      axs[2].set_title('Sagital (YZ)')
-      axs[2].axis('off')
+        self.volume = volume
+        return usados
 
-      plt.tight_layout()
-      plt.show()
+    def iterar_cortes(self, lectura_anticipada=4):
+        """
+        Generador de (índice, corte, metadatos) en el orden de la serie, sin armar el volumen.
+
+        Solo se leen las cabeceras (o se consulta el catálogo) y luego cada corte se decodifica
+        en segundo plano con hasta 'lectura_anticipada' cortes por delante del consumidor,
+        así que la memoria usada no depende del tamaño de la serie. Se combina con
+        segmentar_cortes() y morfologia_cortes():
+
+            cortes = loader.iterar_cortes()
+            for i, mascara, meta in morfologia_cortes(segmentar_cortes(cortes, "binario", 300), "open"):
+                ...
+        """
+        if self.folder_path is None or self.indice is None:
+            self.indice = self._indice()
+            self.folder_path = self.folder_path or self.indice.folder_path
+        indice = self.indice
+        decodificador = indice.decodificador
+        self.decodificador = decodificador
+        avisado = False
+
+        pool = ThreadPoolExecutor(max_workers=max(1, lectura_anticipada))
+        pendientes = deque()
+        siguiente = 0
+        try:
+            for i in range(len(indice)):
+                while siguiente < len(indice) and len(pendientes) <= lectura_anticipada:
+                    pendientes.append(pool.submit(_decodificar_corte_con_backend, indice.rutas[siguiente],
+                                                  decodificador))
+                    siguiente += 1
+                corte, usado = pendientes.popleft().result()
+                if usado == DECODIFICADOR_RESPALDO and not avisado:
+                    print(f"Aviso: el decodificador '{decodificador}' falló; se usa {DECODIFICADOR_RESPALDO}.")
+                    self.decodificador = DECODIFICADOR_RESPALDO
+                    avisado = True
+                yield i, corte, indice.metadatos(i)
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _reservar_volumen(self):
+        """Reserva un único volumen contiguo con la forma y tipo del índice."""
+        return np.empty((len(self.indice),) + self.indice.forma, dtype=self.indice.dtype)
+
+    def _load_serial(self):
+        """
+        Decodifica corte a corte directamente sobre el volumen; cada Dataset se libera al terminar.
+        Devuelve (volumen, backend usado en cada corte).
+        """
+        volume = self._reservar_volumen()
+        decodificador = self.indice.decodificador
+        usados = []
+        for i, ruta in enumerate(self.indice.rutas):
+            corte, usado = _decodificar_corte_con_backend(ruta, decodificador)
+            _colocar_corte(volume[i], corte)
+            usados.append(usado)
+        return volume, usados
+
+    def _load_paralelo(self, workers, indice=None):
+        """
+        Lee cabeceras (si no se pasa el índice) y decodifica los píxeles en paralelo,
+        escribiendo cada corte en su lugar. Devuelve (volumen, backend usado en cada corte).
+        """
+        pool_cls = ThreadPoolExecutor if self.backend == "thread" else ProcessPoolExecutor
+
+        with pool_cls(max_workers=workers) as pool:
+            def mapa(funcion, elementos):
+                chunksize = max(1, len(elementos) // (workers * 4))
+                return pool.map(funcion, elementos, chunksize=chunksize)
+
+            # Ordenar por InstanceNumber leyendo solo las cabeceras (orden estable, igual que la carga serial)
+            self.indice = indice if indice is not None else self._indice(mapa)
+            rutas = self.indice.rutas
+            decodificar = functools.partial(_decodificar_corte_con_backend, decodificador=self.indice.decodificador)
+            volume = self._reservar_volumen()
+
+            if self.backend == "thread":
+                def _decodificar_en(i):
+                    corte, usado = decodificar(rutas[i])
+                    _colocar_corte(volume[i], corte)
+                    return usado
+
+                # list() propaga cualquier excepción de los hilos
+                usados = list(pool.map(_decodificar_en, range(len(rutas))))
+            else:
+                usados = []
+                for i, (corte, usado) in enumerate(mapa(decodificar, rutas)):
+                    _colocar_corte(volume[i], corte)
+                    usados.append(usado)
+
+        return volume, usados
+    
+    def cortes_centrales(self):
+        """Devuelve los cortes centrales transversal, coronal y sagital (sin mostrar nada)."""
+        if self.volume is None:
+            raise ValueError("Primero debes cargar los datos DICOM con el método load().")
+
+        z, y, x = np.array(self.volume.shape) // 2  # posiciones centrales
+        return self.volume[z, :, :], self.volume[:, y, :], self.volume[:, :, x]
+
+    def mostrar_cortes(self):
+        """Muestra los tres cortes principales del volumen"""
+        transversal, coronal, sagital = self.cortes_centrales()
+        mostrar_imagenes([(transversal, 'Transversal (XY)'),
+                          (coronal, 'Coronal (XZ)'),
+                          (sagital, 'Sagital (YZ)')], figsize=(12, 4))
     
 # Clase para mostrar la información del estudio DICOM
 class EstudioImaginologico:
-    def __init__(self, folder_path, volume):
-        """Crea un estudio imaginológico a partir de una carpeta DICOM y su volumen reconstruido."""
+    def __init__(self, folder_path, volume, indice=None):
+        """
+        Crea un estudio imaginológico a partir de una carpeta DICOM y su volumen reconstruido.
+        Si se pasa el IndiceSerie del cargador, las etiquetas se toman de él sin releer archivos.
+        """
         self.folder_path = folder_path
         self.volume = volume
 
-        # Tomar el primer archivo DICOM de la carpeta
-        primer_archivo = [f for f in os.listdir(folder_path) if f.lower().endswith('.dcm')][0]
-        ds = pydicom.dcmread(os.path.join(folder_path, primer_archivo))
+        if indice is None:
+            # Misma serie que elegiría el cargador (no el primer .dcm listado, que en una
+            # carpeta con varias series puede ser de otra)
+            indice = IndiceSerie(folder_path)
+        etiquetas = indice.etiquetas
 
         # Extraer atributos DICOM relevantes
-        self.study_date = getattr(ds, "StudyDate", None)
-        self.study_time = getattr(ds, "StudyTime", None)
-        self.modality = getattr(ds, "Modality", None)
-        self.study_description = getattr(ds, "StudyDescription", None)
-        self.series_time = getattr(ds, "SeriesTime", None)
+        self.study_date = etiquetas["StudyDate"]
+        self.study_time = etiquetas["StudyTime"]
+        self.modality = etiquetas["Modality"]
+        self.study_description = etiquetas["StudyDescription"]
+        self.series_time = etiquetas["SeriesTime"]
 
         # Calcular la duración del estudio
         self.duracion = self._calcular_duracion()
@@ -97,180 +1275,1347 @@ class EstudioImaginologico:
         print(f"Duración (segundos):     {self.duracion}")
         print(f"Forma del volumen:       {self.volume.shape}")
 
+# Tipos de binarización disponibles en segmentar()/segmentar_volumen()
+METODOS_BINARIZACION = {
+    "binario": cv2.THRESH_BINARY,
+    "binario_inv": cv2.THRESH_BINARY_INV,
+    "truncado": cv2.THRESH_TRUNC,
+    "tozero": cv2.THRESH_TOZERO,
+    "tozero_inv": cv2.THRESH_TOZERO_INV
+}
+
+# Eje del volumen (cortes, filas, columnas) que recorre cada tipo de corte
+EJES_CORTE = {"axial": 0, "coronal": 1, "sagital": 2}
+
+# Tipos de dato que acepta cv2.threshold
+_TIPOS_THRESHOLD_CV2 = (np.uint8, np.int16, np.uint16, np.float32, np.float64)
+
+
+def _metodo_binarizacion(tipo_binarizacion):
+    """Traduce el nombre del tipo de binarización a la constante de OpenCV."""
+    metodo = METODOS_BINARIZACION.get(tipo_binarizacion.lower())
+    if metodo is None:
+        raise ValueError("Tipo de binarización no válido")
+    return metodo
+
+
+def _umbralizar(datos, umbral, maximo, metodo):
+    """
+    Aplica el umbral a un arreglo de cualquier dimensión en una sola pasada.
+    Usa cv2.threshold sobre una vista 2D cuando el tipo de dato lo permite y
+    NumPy en caso contrario (mismo resultado que cv2 para los cinco tipos).
+    """
+    if datos.dtype.type in _TIPOS_THRESHOLD_CV2:
+        plano = np.ascontiguousarray(datos).reshape(-1, datos.shape[-1])
+        _, resultado = cv2.threshold(plano, umbral, maximo, metodo)
+        return resultado.reshape(datos.shape)
+
+    mayor = datos > umbral
+    if metodo == cv2.THRESH_BINARY:
+        return np.where(mayor, maximo, 0).astype(datos.dtype)
+    if metodo == cv2.THRESH_BINARY_INV:
+        return np.where(mayor, 0, maximo).astype(datos.dtype)
+    if metodo == cv2.THRESH_TRUNC:
+        return np.where(mayor, umbral, datos).astype(datos.dtype)
+    if metodo == cv2.THRESH_TOZERO:
+        return np.where(mayor, datos, 0).astype(datos.dtype)
+    return np.where(mayor, 0, datos).astype(datos.dtype)
+
+
+# Métodos de umbral automático aceptados como 'umbral' en segmentar()/segmentar_volumen()
+METODOS_UMBRAL = ("otsu", "triangulo", "percentil")
+
+# Número máximo de bins del histograma del volumen
+_MAX_BINS_HISTOGRAMA = 65536
+
+
+def _histograma_volumen(volume, cortes_por_bloque=32):
+    """
+    Calcula el histograma de intensidades del volumen recorriéndolo por bloques.
+    Devuelve (centros, conteos). Para enteros con rango <= 65536 el histograma es
+    exacto (un bin por valor); en otro caso se usan 65536 bins uniformes.
+    """
+    n = volume.shape[0]
+    bloques = [(i, min(i + cortes_por_bloque, n)) for i in range(0, n, cortes_por_bloque)]
+
+    minimo = min(np.min(volume[i:f]) for i, f in bloques)
+    maximo = max(np.max(volume[i:f]) for i, f in bloques)
+
+    if np.issubdtype(volume.dtype, np.integer) and int(maximo) - int(minimo) < _MAX_BINS_HISTOGRAMA:
+        minimo, maximo = int(minimo), int(maximo)
+        conteos = np.zeros(maximo - minimo + 1, dtype=np.int64)
+        for i, f in bloques:
+            bloque = np.asarray(volume[i:f]).ravel()
+            if minimo != 0:
+                bloque = bloque.astype(np.int64) - minimo
+            conteos += np.bincount(bloque, minlength=len(conteos))
+        centros = np.arange(minimo, maximo + 1, dtype=np.float64)
+        return centros, conteos
+
+    minimo, maximo = float(minimo), float(maximo)
+    if maximo == minimo:
+        maximo = minimo + 1.0
+    conteos = np.zeros(_MAX_BINS_HISTOGRAMA, dtype=np.int64)
+    for i, f in bloques:
+        conteos += np.histogram(volume[i:f], bins=_MAX_BINS_HISTOGRAMA, range=(minimo, maximo))[0]
+    ancho = (maximo - minimo) / _MAX_BINS_HISTOGRAMA
+    centros = minimo + ancho * np.arange(_MAX_BINS_HISTOGRAMA)
+    return centros, conteos
+
+
+def _umbral_otsu(centros, conteos):
+    """Umbral de Otsu: maximiza la varianza entre clases del histograma."""
+    p = conteos / conteos.sum()
+    w0 = np.cumsum(p)
+    mu = np.cumsum(p * centros)
+    mu_t = mu[-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        varianza = (mu_t * w0 - mu) ** 2 / (w0 * (1.0 - w0))
+    varianza = np.nan_to_num(varianza, nan=0.0, posinf=0.0)
+    return float(centros[int(np.argmax(varianza))])
+
+
+def _umbral_triangulo(centros, conteos):
+    """Umbral del triángulo: punto más alejado de la recta entre el pico y el extremo más lejano."""
+    no_nulos = np.flatnonzero(conteos)
+    if len(no_nulos) < 2:
+        return float(centros[no_nulos[0]]) if len(no_nulos) else float(centros[0])
+    primero, ultimo = no_nulos[0], no_nulos[-1]
+    pico = int(np.argmax(conteos))
+
+    # El triángulo se construye hacia la cola más larga del histograma
+    extremo = ultimo if (ultimo - pico) > (pico - primero) else primero
+    if extremo == pico:
+        return float(centros[pico])
+    inicio, fin = sorted((pico, extremo))
+    x = np.arange(inicio, fin + 1)
+    h = conteos[inicio:fin + 1].astype(np.float64)
+
+    # Distancia (sin normalizar) de cada bin a la recta pico-extremo
+    x0, y0, x1, y1 = pico, float(conteos[pico]), extremo, float(conteos[extremo])
+    distancia = np.abs((y1 - y0) * x - (x1 - x0) * h + x1 * y0 - y1 * x0)
+    return float(centros[x[int(np.argmax(distancia))]])
+
+
+def _umbral_percentil(centros, conteos, percentil):
+    """Umbral en el percentil dado de la distribución de intensidades."""
+    acumulado = np.cumsum(conteos)
+    k = int(np.searchsorted(acumulado, acumulado[-1] * percentil / 100.0))
+    return float(centros[min(k, len(centros) - 1)])
+
+
+# Elementos estructurantes 3D disponibles en morfologia_3d()
+FORMAS_ELEMENTO = ("cubo", "bola", "cruz")
+
+# Tipos de dato que aceptan cv2.erode/cv2.dilate
+_TIPOS_MORFOLOGIA_CV2 = (np.uint8, np.uint16, np.int16, np.float32, np.float64)
+
+
+def _identidad_morfologica(dtype, erosion):
+    """Valor neutro del mínimo (erosión) o del máximo (dilatación) para el tipo de dato."""
+    if np.issubdtype(dtype, np.floating):
+        return np.inf if erosion else -np.inf
+    info = np.iinfo(dtype)
+    return info.max if erosion else info.min
+
+
+def _filtro_z(bloque, k, erosion):
+    """
+    Mínimo (erosión) o máximo (dilatación) en una ventana de k cortes a lo largo del eje 0,
+    anclada en k // 2 como OpenCV. Usa duplicación de ventanas: O(log k) pasadas en vez de k.
+    """
+    if k <= 1:
+        return bloque
+    op = np.minimum if erosion else np.maximum
+    antes = k // 2
+    r = np.pad(bloque, ((antes, k - 1 - antes), (0, 0), (0, 0)),
+               constant_values=_identidad_morfologica(bloque.dtype, erosion))
+    largo = 1
+    while 2 * largo <= k:
+        r = op(r[:-largo], r[largo:])
+        largo *= 2
+    if largo < k:
+        # Dos ventanas solapadas de 'largo' cubren exactamente k cortes
+        r = op(r[:len(r) - (k - largo)], r[k - largo:])
+    return r
+
+
+def _morfologia_plano(bloque, kernel, erosion):
+    """Erosión/dilatación 2D de cada corte del bloque con cv2 (bordes neutros, como cv2 por defecto)."""
+    funcion = cv2.erode if erosion else cv2.dilate
+    salida = np.empty_like(bloque)
+    for i in range(bloque.shape[0]):
+        salida[i] = funcion(bloque[i], kernel)
+    return salida
+
+
+def _disco(radio2, tamano):
+    """Kernel 2D circular (x² + y² <= radio2) centrado en una matriz tamano x tamano."""
+    c = tamano // 2
+    y, x = np.ogrid[:tamano, :tamano]
+    return ((x - c) ** 2 + (y - c) ** 2 <= radio2).astype(np.uint8)
+
+
+# Radio máximo de la 'bola' que se calcula exacta; por encima se aproxima por pasos 3x3x3
+_RADIO_MAX_BOLA_EXACTA = 3
+
+
+def _bola_exacta(bloque, radio, erosion):
+    """
+    Bola exacta (x² + y² + z² <= radio²) como unión de discos por corte: un filtro 2D por
+    radio distinto. cv2 aplica los discos punto a punto, así que el coste es O(k³) por vóxel;
+    solo se usa con radios pequeños.
+    """
+    op = np.minimum if erosion else np.maximum
+    tamano = 2 * radio + 1
+    por_radio = {}
+    resultado = None
+    n = bloque.shape[0]
+    for dz in range(-radio, radio + 1):
+        r2 = radio ** 2 - dz ** 2
+        if r2 not in por_radio:
+            por_radio[r2] = _morfologia_plano(bloque, _disco(r2, tamano), erosion)
+        plano = por_radio[r2]
+        if dz == 0:
+            resultado = plano.copy() if resultado is None else op(resultado, plano, out=resultado)
+            continue
+        if resultado is None:
+            resultado = np.full_like(bloque, _identidad_morfologica(bloque.dtype, erosion))
+        # resultado[z] combina plano[z + dz]; fuera del bloque el vecino es neutro
+        if abs(dz) >= n:
+            continue
+        if dz > 0:
+            op(resultado[:-dz], plano[dz:], out=resultado[:-dz])
+        else:
+            op(resultado[-dz:], plano[:dz], out=resultado[-dz:])
+    return resultado
+
+
+def _bola_por_pasos(bloque, radio, erosion):
+    """
+    Bola aproximada como suma de Minkowski de n cubos 3x3x3 y radio - n cruces de 6 vecinos
+    (octaedros), con n ≈ 0.3 * radio (la proporción que más se acerca a la bola exacta):
+    el poliedro llega a 'radio' en los ejes y difiere de la bola en un 10-25 % de sus vóxeles
+    según el radio, todos cerca de la superficie. Son 'radio' pasos de coste constante por vóxel:
+    O(k) en vez de O(k³).
+    """
+    op = np.minimum if erosion else np.maximum
+    cruz = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
+    cuadrado = np.ones((3, 3), np.uint8)
+    n_cubos = int(0.3 * radio + 0.25)
+    resultado = bloque
+    for _ in range(n_cubos):
+        resultado = _filtro_z(_morfologia_plano(resultado, cuadrado, erosion), 3, erosion)
+    for _ in range(radio - n_cubos):
+        resultado = op(_morfologia_plano(resultado, cruz, erosion), _filtro_z(resultado, 3, erosion))
+    return resultado
+
+
+def _morfologia_basica_3d(bloque, kernel_size, forma, erosion):
+    """Erosión o dilatación 3D de un bloque completo con el elemento estructurante indicado."""
+    k = kernel_size
+    if forma == "cubo":
+        # Cubo = cuadrado en el plano (separable en cv2) seguido de una línea en z
+        plano = _morfologia_plano(bloque, np.ones((k, k), np.uint8), erosion)
+        return _filtro_z(plano, k, erosion)
+
+    op = np.minimum if erosion else np.maximum
+    if forma == "cruz":
+        # Cruz 3D = unión de la cruz del plano y la línea en z: se combinan sus resultados
+        plano = _morfologia_plano(bloque, cv2.getStructuringElement(cv2.MORPH_CROSS, (k, k)), erosion)
+        return op(plano, _filtro_z(bloque, k, erosion))
+
+    radio = k // 2
+    if radio <= _RADIO_MAX_BOLA_EXACTA:
+        return _bola_exacta(bloque, radio, erosion)
+    return _bola_por_pasos(bloque, radio, erosion)
+
+
+def _pasada_3d(volume, kernel_size, forma, erosion, workers, cortes_por_bloque):
+    """Aplica una erosión/dilatación 3D por bloques de cortes con solape (halo) en z."""
+    n = volume.shape[0]
+    halo = kernel_size // 2
+    salida = np.empty(volume.shape, dtype=volume.dtype)
+    bloques = [(i, min(i + cortes_por_bloque, n)) for i in range(0, n, cortes_por_bloque)]
+    convertir = volume.dtype.type not in _TIPOS_MORFOLOGIA_CV2
+
+    def _procesar(bloque):
+        inicio, fin = bloque
+        a, b = max(0, inicio - halo), min(n, fin + halo)
+        datos = np.ascontiguousarray(volume[a:b])
+        if convertir:
+            datos = datos.astype(np.float64)
+        resultado = _morfologia_basica_3d(datos, kernel_size, forma, erosion)
+        salida[inicio:fin] = resultado[inicio - a:fin - a]
+
+    if workers and workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(_procesar, bloques))
+    else:
+        for bloque in bloques:
+            _procesar(bloque)
+    return salida
+
+
+def morfologia_3d(volume, operacion, kernel_size=3, forma="cubo", workers=None, cortes_por_bloque=32):
+    """
+    Transformación morfológica volumétrica (erode, dilate, open, close).
+
+    forma: elemento estructurante 3D 'cubo' (k x k x k), 'cruz' (brazos de k vóxeles en
+           los tres ejes) o 'bola' (radio k // 2; exacta hasta k = 7, para kernels mayores
+           se aproxima con un poliedro de pasos 3x3x3 para que el coste crezca como O(k)).
+    El volumen se procesa por bloques de 'cortes_por_bloque' cortes con un halo de
+    k // 2 cortes, opcionalmente en un pool de hilos; el resultado es idéntico al de
+    procesar el volumen entero de una vez.
+    """
+    if forma not in FORMAS_ELEMENTO:
+        raise ValueError("Elemento estructurante no válido. Usa: 'cubo', 'bola' o 'cruz'.")
+    pasos = {
+        "erode": (True,),
+        "dilate": (False,),
+        "open": (True, False),
+        "close": (False, True),
+    }.get(operacion)
+    if pasos is None:
+        raise ValueError("Operación morfológica no válida. Usa: 'erode', 'dilate', 'open' o 'close'.")
+
+    resultado = volume
+    with _span("morfologia", volume.nbytes):
+        for erosion in pasos:
+            resultado = _pasada_3d(resultado, kernel_size, forma, erosion, workers, cortes_por_bloque)
+    return resultado
+
+
+def segmentar_cortes(cortes, tipo_binarizacion, umbral=100):
+    """
+    Versión en streaming de segmentar_volumen(): umbraliza cada (índice, corte, metadatos)
+    de 'cortes' (p. ej. DicomLoader.iterar_cortes()) y lo devuelve con la máscara en su lugar.
+    El umbral debe ser un número: los automáticos necesitan el histograma de todo el volumen.
+    """
+    metodo = _metodo_binarizacion(tipo_binarizacion)
+    if isinstance(umbral, str):
+        raise ValueError("En streaming el umbral debe ser numérico (los automáticos necesitan todo el volumen).")
+    for i, corte, meta in cortes:
+        with _span("segmentacion", corte.nbytes):
+            mascara = _umbralizar(corte, umbral, 255, metodo)
+        yield i, mascara, meta
+
+
+def _pasada_3d_streaming(cortes, kernel_size, forma, erosion, cortes_por_bloque):
+    """
+    Erosión/dilatación 3D de una secuencia de cortes, por bloques con halo de k // 2 cortes
+    (igual que _pasada_3d); solo se guardan en memoria el bloque actual y sus halos.
+    """
+    halo = kernel_size // 2
+    buffer = []  # (índice, corte, metadatos); buffer[0] es el primer corte aún necesario
+    proximo = 0  # posición en buffer del siguiente corte a emitir
+
+    def _emitir(inicio, fin):
+        a, b = max(0, inicio - halo), min(len(buffer), fin + halo)
+        datos = np.stack([c for _, c, _ in buffer[a:b]])
+        dtype = datos.dtype
+        if dtype.type not in _TIPOS_MORFOLOGIA_CV2:
+            datos = datos.astype(np.float64)
+        with _span("morfologia", datos[inicio - a:fin - a].nbytes):
+            resultado = _morfologia_basica_3d(datos, kernel_size, forma, erosion)
+        for j in range(inicio, fin):
+            i, _, meta = buffer[j]
+            yield i, resultado[j - a].astype(dtype, copy=False), meta
+
+    for elemento in cortes:
+        buffer.append(elemento)
+        if len(buffer) >= proximo + cortes_por_bloque + halo:
+            yield from _emitir(proximo, proximo + cortes_por_bloque)
+            proximo += cortes_por_bloque
+            sobrantes = proximo - halo
+            if sobrantes > 0:
+                del buffer[:sobrantes]
+                proximo -= sobrantes
+
+    while proximo < len(buffer):
+        yield from _emitir(proximo, min(proximo + cortes_por_bloque, len(buffer)))
+        proximo += cortes_por_bloque
+
+
+def morfologia_cortes(cortes, operacion, kernel_size=3, forma="cubo", cortes_por_bloque=8):
+    """
+    Versión en streaming de morfologia_3d(): recibe y devuelve (índice, corte, metadatos).
+    El resultado es idéntico al de morfologia_3d() sobre el volumen completo; la memoria
+    usada es de unos (cortes_por_bloque + kernel_size) cortes por pasada.
+    """
+    if forma not in FORMAS_ELEMENTO:
+        raise ValueError("Elemento estructurante no válido. Usa: 'cubo', 'bola' o 'cruz'.")
+    pasos = {
+        "erode": (True,),
+        "dilate": (False,),
+        "open": (True, False),
+        "close": (False, True),
+    }.get(operacion)
+    if pasos is None:
+        raise ValueError("Operación morfológica no válida. Usa: 'erode', 'dilate', 'open' o 'close'.")
+
+    for erosion in pasos:
+        cortes = _pasada_3d_streaming(cortes, kernel_size, forma, erosion, cortes_por_bloque)
+    return cortes
+
+
+def _tabla_valores(dtype):
+    """Todos los valores posibles de un tipo entero de 8/16 bits, en el orden de su patrón de bits."""
+    sin_signo = np.dtype(f"u{dtype.itemsize}")
+    return np.arange(2 ** (8 * dtype.itemsize), dtype=sin_signo).view(dtype)
+
+
+def _usa_lut(dtype):
+    return np.issubdtype(dtype, np.integer) and dtype.itemsize <= 2
+
+
+def normalizar_uint8(imagen, minimo=None, maximo=None, lut=None, salida=None):
+    """
+    Lleva una imagen (o volumen) a uint8: ((imagen - minimo) / (maximo - minimo) * 255).
+
+    minimo/maximo: rango a usar; por defecto el de la propia imagen. Los valores fuera
+                   del rango se recortan a 0/255.
+    Para enteros de 8/16 bits se usa una tabla de búsqueda (sin temporales en float);
+    para el resto, aritmética float32 en el lugar. Una imagen constante da ceros.
+    """
+    if minimo is None:
+        minimo = np.min(imagen)
+    if maximo is None:
+        maximo = np.max(imagen)
+    minimo, maximo = float(minimo), float(maximo)
+    if salida is None:
+        salida = np.empty(imagen.shape, dtype=np.uint8)
+
+    if maximo <= minimo:
+        salida[...] = 0
+        return salida
+
+    if _usa_lut(imagen.dtype):
+        if lut is None:
+            lut = _lut_uint8(imagen.dtype, minimo, maximo)
+        indices = np.asarray(imagen).view(f"u{imagen.dtype.itemsize}")
+        return np.take(lut, indices, out=salida, mode="clip")
+
+    temporal = np.asarray(imagen, dtype=np.float32).copy()
+    temporal -= minimo
+    temporal *= 255.0 / (maximo - minimo)
+    np.clip(temporal, 0, 255, out=temporal)
+    salida[...] = temporal
+    return salida
+
+
+def _lut_uint8(dtype, minimo, maximo):
+    """Tabla de búsqueda uint8 para todos los valores del tipo entero (misma fórmula en float64)."""
+    valores = _tabla_valores(np.dtype(dtype)).astype(np.float64)
+    lut = (valores - minimo) / (maximo - minimo) * 255
+    return np.clip(lut, 0, 255).astype(np.uint8)
+
+
+class Normalizador:
+    """
+    Normalización a uint8 con un rango fijo calculado una sola vez (por volumen o por
+    ventana DICOM). Guarda la tabla de búsqueda de cada tipo entero ya usado.
+    """
+
+    def __init__(self, minimo, maximo):
+        self.minimo = float(minimo)
+        self.maximo = float(maximo)
+        self._luts = {}
+
+    @classmethod
+    def desde_volumen(cls, volume, cortes_por_bloque=32):
+        """Rango = mínimo y máximo de todo el volumen (recorrido por bloques)."""
+        n = volume.shape[0]
+        bloques = [(i, min(i + cortes_por_bloque, n)) for i in range(0, n, cortes_por_bloque)]
+        minimo = min(np.min(volume[i:f]) for i, f in bloques)
+        maximo = max(np.max(volume[i:f]) for i, f in bloques)
+        return cls(minimo, maximo)
+
+    @classmethod
+    def desde_ventana(cls, centro, ancho, pendiente=1.0, intercepto=0.0):
+        """
+        Rango a partir de WindowCenter/WindowWidth (en unidades reescaladas, p. ej. HU),
+        llevado a valores almacenados con RescaleSlope/RescaleIntercept.
+        """
+        bajo = (centro - ancho / 2.0 - intercepto) / pendiente
+        alto = (centro + ancho / 2.0 - intercepto) / pendiente
+        return cls(min(bajo, alto), max(bajo, alto))
+
+    def lut(self, dtype):
+        """Tabla de búsqueda para el tipo entero dado (se construye una sola vez)."""
+        dtype = np.dtype(dtype)
+        if dtype not in self._luts:
+            self._luts[dtype] = _lut_uint8(dtype, self.minimo, self.maximo)
+        return self._luts[dtype]
+
+    def __call__(self, imagen, salida=None):
+        lut = self.lut(imagen.dtype) if _usa_lut(imagen.dtype) and self.maximo > self.minimo else None
+        return normalizar_uint8(imagen, self.minimo, self.maximo, lut=lut, salida=salida)
+
+
+def normalizar_volumen_uint8(volume, normalizador=None, cortes_por_bloque=32, workers=None):
+    """
+    Versión para todo el volumen: devuelve un volumen uint8 con un único rango
+    (por defecto el del volumen completo), procesado por bloques de cortes.
+    """
+    if normalizador is None:
+        normalizador = Normalizador.desde_volumen(volume, cortes_por_bloque)
+    n = volume.shape[0]
+    salida = np.empty(volume.shape, dtype=np.uint8)
+    bloques = [(i, min(i + cortes_por_bloque, n)) for i in range(0, n, cortes_por_bloque)]
+
+    def _normalizar_bloque(bloque):
+        inicio, fin = bloque
+        normalizador(np.asarray(volume[inicio:fin]), salida=salida[inicio:fin])
+
+    if workers and workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(_normalizar_bloque, bloques))
+    else:
+        for bloque in bloques:
+            _normalizar_bloque(bloque)
+    return salida
+
+
+def _indices_lineales(n_entrada, paso, n_salida):
+    """Índices vecinos y pesos para interpolar linealmente n_salida muestras cada 'paso' muestras."""
+    posiciones = np.arange(n_salida, dtype=np.float64) * paso
+    i0 = np.clip(np.floor(posiciones).astype(np.intp), 0, n_entrada - 1)
+    i1 = np.minimum(i0 + 1, n_entrada - 1)
+    pesos = (posiciones - i0).astype(np.float32)
+    return i0, i1, pesos
+
+
+def _interpolar_eje(datos, eje, i0, i1, pesos):
+    """Interpolación lineal vectorizada a lo largo de un eje (resultado en float32)."""
+    a = np.take(datos, i0, axis=eje).astype(np.float32)
+    b = np.take(datos, i1, axis=eje)
+    forma = [1] * datos.ndim
+    forma[eje] = -1
+    a += (b - a) * pesos.reshape(forma)
+    return a
+
+
+def _a_tipo(datos, dtype):
+    """Convierte el resultado float32 al tipo original (redondeando si es entero)."""
+    if np.issubdtype(dtype, np.integer):
+        np.rint(datos, out=datos)
+    return datos.astype(dtype, copy=False)
+
+
+def remuestrear_volumen(volume, espaciado, nuevo_espaciado, cortes_por_bloque=16, workers=None):
+    """
+    Remuestrea el volumen (cortes, filas, columnas) de 'espaciado' a 'nuevo_espaciado' (mm)
+    con interpolación lineal separable: primero filas y columnas por bloques de cortes y luego
+    el eje z por bloques de filas. El primer vóxel conserva su posición.
+    """
+    forma = volume.shape
+    ejes = []
+    for n, antiguo, nuevo in zip(forma, espaciado, nuevo_espaciado):
+        paso = float(nuevo) / float(antiguo)
+        n_salida = int(np.floor((n - 1) / paso + 1e-9)) + 1
+        ejes.append(None if n_salida == n and paso == 1 else (_indices_lineales(n, paso, n_salida), n_salida))
+    forma_salida = tuple(e[1] if e else n for e, n in zip(ejes, forma))
+
+    def _ejecutar(funcion, bloques):
+        if workers and workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(funcion, bloques))
+        else:
+            for bloque in bloques:
+                funcion(bloque)
+
+    # Paso 1: plano (filas y columnas) por bloques de cortes
+    if ejes[1] or ejes[2]:
+        intermedio = np.empty((forma[0],) + forma_salida[1:], dtype=np.float32 if ejes[0] else volume.dtype)
+
+        def _plano(bloque):
+            inicio, fin = bloque
+            datos = np.asarray(volume[inicio:fin])
+            for eje in (1, 2):
+                if ejes[eje]:
+                    datos = _interpolar_eje(datos, eje, *ejes[eje][0])
+            intermedio[inicio:fin] = datos if ejes[0] else _a_tipo(datos, volume.dtype)
+
+        _ejecutar(_plano, [(i, min(i + cortes_por_bloque, forma[0])) for i in range(0, forma[0], cortes_por_bloque)])
+    else:
+        intermedio = volume
+
+    if not ejes[0]:
+        return intermedio if intermedio is not volume else np.array(volume)
+
+    # Paso 2: eje z por bloques de filas
+    salida = np.empty(forma_salida, dtype=volume.dtype)
+    filas = forma_salida[1]
+
+    def _z(bloque):
+        inicio, fin = bloque
+        datos = _interpolar_eje(np.asarray(intermedio[:, inicio:fin]), 0, *ejes[0][0])
+        salida[:, inicio:fin] = _a_tipo(datos, volume.dtype)
+
+    _ejecutar(_z, [(i, min(i + cortes_por_bloque, filas)) for i in range(0, filas, cortes_por_bloque)])
+    return salida
+
+
+# Conectividad 3D -> (conectividad en el plano para cv2, desplazamientos (dy, dx) entre cortes vecinos)
+CONECTIVIDADES = {
+    6: (4, ((0, 0),)),
+    18: (8, ((0, 0), (0, 1), (0, -1), (1, 0), (-1, 0))),
+    26: (8, tuple((dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1))),
+}
+
+
+def _pares_unicos(ea, eb):
+    """Descarta los pares (ea, eb) repetidos en posiciones consecutivas (mismo tramo de fila)."""
+    if not ea.size:
+        return None
+    cambio = np.empty(ea.size, dtype=bool)
+    cambio[0] = True
+    np.not_equal(ea[1:], ea[:-1], out=cambio[1:])
+    cambio[1:] |= eb[1:] != eb[:-1]
+    return np.stack([ea[cambio], eb[cambio]], axis=1)
+
+
+def _pares_entre_cortes(a, b, desplazamientos):
+    """
+    Pares (etiqueta en a, etiqueta en b) de vóxeles vecinos entre dos cortes consecutivos
+    ya etiquetados. Los pares repetidos en píxeles contiguos se descartan sobre la marcha
+    (quedan unos pocos por fila y componente).
+    """
+    filas, columnas = a.shape
+    fa, fb = a != 0, b != 0
+    ambos = fa & fb
+    pares = [_pares_unicos(a[ambos], b[ambos])]
+
+    if len(desplazamientos) > 1:
+        # Con conectividad 8 en el plano, un vecino en diagonal solo aporta un par nuevo si ni
+        # el píxel de a ni el de b tienen primer plano en la misma posición del otro corte
+        # (si no, ese vecino ya es de la misma componente 2D): basta mirar los bordes.
+        solo_a = (fa & ~fb).view(np.uint8)
+        elemento = np.zeros((3, 3), np.uint8)
+        for dy, dx in desplazamientos:
+            elemento[1 + dy, 1 + dx] = 1
+        puntos = cv2.findNonZero(((fb & ~fa) & cv2.dilate(solo_a, elemento).view(bool)).view(np.uint8))
+        if puntos is None:
+            return [p for p in pares if p is not None]
+        puntos = puntos.reshape(-1, 2)
+        xs, ys = puntos[:, 0], puntos[:, 1]
+        eb = b[ys, xs]
+        for dy, dx in desplazamientos:
+            if dy == 0 and dx == 0:
+                continue
+            # b[y, x] es vecino de a[y + dy, x + dx]
+            yy, xx = ys + dy, xs + dx
+            dentro = (yy >= 0) & (yy < filas) & (xx >= 0) & (xx < columnas)
+            ea = a[yy[dentro], xx[dentro]]
+            vecinos = ea != 0
+            pares.append(_pares_unicos(ea[vecinos], eb[dentro][vecinos]))
+    return [p for p in pares if p is not None]
+
+
+def _unir(n, pares):
+    """
+    Union-find vectorizado (enganche al mínimo + compresión de caminos) sobre 'pares'.
+    Devuelve para cada etiqueta 0..n la etiqueta mínima de su componente.
+    """
+    padre = np.arange(n + 1, dtype=np.int64)
+    if not len(pares):
+        return padre
+    a, b = pares[:, 0], pares[:, 1]
+    while True:
+        pa, pb = padre[a], padre[b]
+        distintos = pa != pb
+        if not distintos.any():
+            return padre
+        pa, pb = pa[distintos], pb[distintos]
+        minimo = np.minimum(pa, pb)
+        np.minimum.at(padre, np.maximum(pa, pb), minimo)
+        while True:
+            abuelo = padre[padre]
+            if np.array_equal(abuelo, padre):
+                break
+            padre = abuelo
+
+
+class ComponentesConexas:
+    """
+    Componentes conexas 3D de una máscara de segmentación y sus estadísticas por etiqueta.
+
+    etiquetas: volumen int32 (0 = fondo, 1..n ordenadas por el primer corte en que aparece cada
+        componente; dentro de un mismo corte el orden es el de cv2 y no está garantizado).
+    Por cada etiqueta i (posición i - 1 de los arreglos):
+        voxeles, volumen_mm3, caja (z0, y0, x0, z1, y1, x1 inclusivos), centroide (z, y, x en
+        vóxeles), centroide_mm e intensidad_media (si se pasaron intensidades).
+    """
+
+    def __init__(self, mascara, conectividad=26, espaciado=(1.0, 1.0, 1.0), intensidades=None, workers=None):
+        """
+        mascara: volumen (cortes, filas, columnas); todo valor distinto de 0 es primer plano.
+        conectividad: 6 (caras), 18 (caras y aristas) o 26 (caras, aristas y vértices).
+        espaciado: mm por vóxel en (z, y, x), p. ej. Geometria.espaciado.
+        intensidades: volumen original para la intensidad media de cada componente.
+        workers: hilos para etiquetar y enlazar los cortes (cv2 libera el GIL).
+        """
+        if conectividad not in CONECTIVIDADES:
+            raise ValueError("Conectividad no válida. Usa: 6, 18 o 26.")
+        if mascara.ndim != 3:
+            raise ValueError("La máscara debe ser un volumen 3D (cortes, filas, columnas).")
+        if intensidades is not None and intensidades.shape != mascara.shape:
+            raise ValueError("Las intensidades deben tener la forma de la máscara.")
+        conectividad_plano, desplazamientos = CONECTIVIDADES[conectividad]
+        self.conectividad = conectividad
+        self.espaciado = tuple(float(e) for e in espaciado)
+        nz = mascara.shape[0]
+        self.etiquetas = np.empty(mascara.shape, dtype=np.int32)
+
+        def _mapa(funcion, elementos):
+            if workers and workers > 1:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    return list(pool.map(funcion, elementos))
+            return [funcion(e) for e in elementos]
+
+        # Paso 1: componentes 2D de cada corte con sus estadísticas (área, caja, centroide)
+        def _etiquetar(z):
+            plano = np.asarray(mascara[z])
+            # cv2 toma como primer plano todo valor distinto de 0 (máscaras uint8 sin convertir)
+            plano = np.ascontiguousarray(plano) if plano.dtype == np.uint8 else (plano != 0).view(np.uint8)
+            n, etiquetas, stats, centroides = cv2.connectedComponentsWithStats(
+                plano, labels=self.etiquetas[z], connectivity=conectividad_plano, ltype=cv2.CV_32S)
+            suma = None
+            if intensidades is not None:
+                suma = np.bincount(etiquetas.ravel(), weights=np.asarray(intensidades[z], dtype=np.float64).ravel(),
+                                   minlength=n)[1:]
+            return n - 1, stats[1:], centroides[1:], suma
+
+        with _span("componentes", mascara.nbytes):
+            por_corte = _mapa(_etiquetar, range(nz))
+            cuentas = np.array([p[0] for p in por_corte], dtype=np.int64)
+            desplazamiento = np.concatenate([[0], np.cumsum(cuentas)])
+            total = int(desplazamiento[-1])
+
+            # Paso 2: enlaces entre cortes consecutivos (en etiquetas globales) y union-find
+            def _enlazar(z):
+                pares = _pares_entre_cortes(self.etiquetas[z], self.etiquetas[z + 1], desplazamientos)
+                if not pares:
+                    return np.empty((0, 2), dtype=np.int64)
+                pares = np.concatenate(pares).astype(np.int64)
+                pares[:, 0] += desplazamiento[z]
+                pares[:, 1] += desplazamiento[z + 1]
+                return pares
+
+            pares = [p for p in _mapa(_enlazar, range(nz - 1)) if len(p)]
+            raiz = _unir(total, np.concatenate(pares) if pares else np.empty((0, 2), dtype=np.int64))
+
+            # Etiquetas finales consecutivas; la raíz es la menor etiqueta global, que está en
+            # el primer corte de la componente, así que quedan ordenadas por ese corte
+            raices, final = np.unique(raiz[1:], return_inverse=True)
+            final = np.concatenate([[0], final + 1]).astype(np.int32)
+            self.n = len(raices)
+
+            def _reetiquetar(z):
+                tabla = final[desplazamiento[z]:desplazamiento[z + 1] + 1].copy()
+                tabla[0] = 0
+                np.take(tabla, self.etiquetas[z], out=self.etiquetas[z])
+
+            _mapa(_reetiquetar, range(nz))
+
+        # Paso 3: estadísticas agregando las de cada componente 2D en su etiqueta 3D
+        with _span("estadisticas"):
+            self._estadisticas(por_corte, final[1:] - 1, intensidades is not None)
+
+    def _estadisticas(self, por_corte, destino, con_intensidad):
+        n = self.n
+        zs = np.concatenate([np.full(p[0], z) for z, p in enumerate(por_corte)]) if n else np.empty(0)
+        stats = np.concatenate([p[1] for p in por_corte]) if n else np.empty((0, 5))
+        centroides = np.concatenate([p[2] for p in por_corte]) if n else np.empty((0, 2))
+        area = stats[:, cv2.CC_STAT_AREA].astype(np.float64)
+
+        self.voxeles = np.bincount(destino, weights=area, minlength=n).astype(np.int64)
+        self.volumen_mm3 = self.voxeles * float(np.prod(self.espaciado))
+        sumas = np.stack([np.bincount(destino, weights=zs * area, minlength=n),
+                          np.bincount(destino, weights=centroides[:, 1] * area, minlength=n),
+                          np.bincount(destino, weights=centroides[:, 0] * area, minlength=n)], axis=1)
+        self.centroide = sumas / np.maximum(self.voxeles, 1)[:, None]
+        self.centroide_mm = self.centroide * np.array(self.espaciado)
+
+        x0, y0 = stats[:, cv2.CC_STAT_LEFT], stats[:, cv2.CC_STAT_TOP]
+        x1, y1 = x0 + stats[:, cv2.CC_STAT_WIDTH] - 1, y0 + stats[:, cv2.CC_STAT_HEIGHT] - 1
+        grande = np.iinfo(np.int64).max
+        self.caja = np.empty((n, 6), dtype=np.int64)
+        for columna, valores, es_min in ((0, zs, True), (1, y0, True), (2, x0, True),
+                                         (3, zs, False), (4, y1, False), (5, x1, False)):
+            acumulado = np.full(n, grande if es_min else -1, dtype=np.int64)
+            (np.minimum if es_min else np.maximum).at(acumulado, destino, valores.astype(np.int64))
+            self.caja[:, columna] = acumulado
+
+        self.intensidad_media = None
+        if con_intensidad:
+            suma = np.concatenate([p[3] for p in por_corte]) if n else np.empty(0)
+            self.intensidad_media = np.bincount(destino, weights=suma, minlength=n) / np.maximum(self.voxeles, 1)
+
+    def __len__(self):
+        return self.n
+
+    def tabla(self, min_voxeles=0):
+        """Estadísticas como lista de diccionarios (una fila por componente), p. ej. para JSON."""
+        filas = []
+        for i in np.flatnonzero(self.voxeles >= min_voxeles):
+            fila = {
+                "etiqueta": int(i + 1),
+                "voxeles": int(self.voxeles[i]),
+                "volumen_mm3": float(self.volumen_mm3[i]),
+                "caja": [int(v) for v in self.caja[i]],
+                "centroide": [float(v) for v in self.centroide[i]],
+                "centroide_mm": [float(v) for v in self.centroide_mm[i]],
+            }
+            if self.intensidad_media is not None:
+                fila["intensidad_media"] = float(self.intensidad_media[i])
+            filas.append(fila)
+        return filas
+
+    def mayores(self, cantidad=1):
+        """Etiquetas de las 'cantidad' componentes con más vóxeles, de mayor a menor."""
+        return (np.argsort(-self.voxeles, kind="stable")[:cantidad] + 1).tolist()
+
+    def mascara(self, etiquetas):
+        """Máscara booleana de una etiqueta o de una lista de etiquetas."""
+        return np.isin(self.etiquetas, np.atleast_1d(etiquetas))
+
+
+# Formatos de exportar_cortes(): un archivo por corte ('png', 'jpg') o uno solo ('tiff' multipágina, 'mosaico' PNG)
+FORMATOS_EXPORTACION = ("png", "jpg", "tiff", "mosaico")
+
+
+def _parametros_compresion(formato, compresion):
+    """Parámetros de cv2.imwrite: nivel 0-9 para PNG, calidad 0-100 para JPEG, 0/1 (LZW) para TIFF."""
+    if formato in ("png", "mosaico"):
+        if not 0 <= compresion <= 9:
+            raise ValueError("El nivel de compresión PNG debe estar entre 0 y 9.")
+        return [cv2.IMWRITE_PNG_COMPRESSION, int(compresion)]
+    if formato == "jpg":
+        if not 0 <= compresion <= 100:
+            raise ValueError("La calidad JPEG debe estar entre 0 y 100.")
+        return [cv2.IMWRITE_JPEG_QUALITY, int(compresion)]
+    return [cv2.IMWRITE_TIFF_COMPRESSION, 5 if compresion else 1]
+
+
+def exportar_cortes(volume, carpeta, tipo="axial", indices=None, formato="png", compresion=3,
+                    workers=None, prefijo="corte", normalizador=None, bits=8, columnas=None):
+    """
+    Exporta muchos cortes de un volumen procesado (máscaras, morfología, etc.) de una vez.
+
+    tipo: eje de los cortes ('axial', 'coronal' o 'sagital'); indices: cortes a exportar
+          (por defecto todos los del eje).
+    formato: 'png' o 'jpg' escriben un archivo por corte (<prefijo>_<tipo>_<i>.<ext>);
+             'tiff' escribe un único TIFF multipágina y 'mosaico' un único PNG con los
+             cortes en una grilla de 'columnas' columnas.
+    compresion: nivel PNG (0-9), calidad JPEG (0-100) o TIFF sin/con compresión (0/1).
+    bits: 8 normaliza a uint8 con un rango único para todos los cortes ('normalizador', por
+          defecto el del volumen); 16 guarda los enteros de 16 bits tal cual (solo PNG/TIFF).
+    La extracción, normalización y codificación de cada corte se hacen en un pool de
+    'workers' hilos (cv2 libera el GIL). Devuelve la lista de archivos escritos.
+    """
+    if formato not in FORMATOS_EXPORTACION:
+        raise ValueError(f"Formato no válido. Usa: {', '.join(FORMATOS_EXPORTACION)}.")
+    if tipo not in EJES_CORTE:
+        raise ValueError("Tipo de corte no válido")
+    if bits not in (8, 16) or (bits == 16 and formato == "jpg"):
+        raise ValueError("Profundidad no válida: 8 bits, o 16 bits solo para PNG/TIFF.")
+    parametros = _parametros_compresion(formato, compresion)
+
+    eje = EJES_CORTE[tipo]
+    n = volume.shape[eje]
+    indices = list(range(n)) if indices is None else [int(i) for i in indices]
+    if not indices:
+        raise ValueError("No hay cortes para exportar.")
+    for i in indices:
+        if not 0 <= i < n:
+            raise ValueError(f"Índice de corte fuera de rango: {i} (el eje {tipo} tiene {n} cortes).")
+
+    dtype = np.dtype(volume.dtype)
+    conservar = dtype == np.uint8 or (bits == 16 and dtype == np.uint16)
+    if not conservar and bits == 16:
+        raise ValueError("Para exportar en 16 bits el volumen debe ser uint16.")
+    if not conservar and normalizador is None:
+        normalizador = Normalizador.desde_volumen(volume)
+    os.makedirs(carpeta, exist_ok=True)
+
+    def _corte(i):
+        clave = [slice(None)] * 3
+        clave[eje] = i
+        corte = np.ascontiguousarray(volume[tuple(clave)])
+        return corte if conservar else normalizador(corte)
+
+    def _mapa(funcion, elementos):
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+            return list(pool.map(funcion, elementos))
+
+    base = os.path.join(carpeta, f"{prefijo}_{tipo}")
+    if formato in ("png", "jpg"):
+        def _exportar(i):
+            ruta = f"{base}_{i:04d}.{formato}"
+            if not _guardar_imagen(ruta, _corte(i), parametros):
+                raise OSError(f"No se pudo escribir {ruta}")
+            return ruta
+        return _mapa(_exportar, indices)
+
+    if formato == "tiff":
+        ruta = f"{base}.tiff"
+        paginas = _mapa(_corte, indices)
+        with _span("escritura_imagen", sum(p.nbytes for p in paginas)):
+            if not cv2.imwritemulti(ruta, paginas, parametros):
+                raise OSError(f"No se pudo escribir {ruta}")
+        return [ruta]
+
+    # Mosaico: cada hilo copia su corte directamente en su celda de la grilla
+    forma = [d for e, d in enumerate(volume.shape) if e != eje]
+    columnas = columnas or int(np.ceil(np.sqrt(len(indices))))
+    filas = int(np.ceil(len(indices) / columnas))
+    grilla = np.zeros((filas * forma[0], columnas * forma[1]), dtype=dtype if conservar else np.uint8)
+
+    def _colocar(posicion_indice):
+        posicion, i = posicion_indice
+        f, c = divmod(posicion, columnas)
+        grilla[f * forma[0]:(f + 1) * forma[0], c * forma[1]:(c + 1) * forma[1]] = _corte(i)
+
+    _mapa(_colocar, enumerate(indices))
+    ruta = f"{base}_mosaico.png"
+    if not _guardar_imagen(ruta, grilla, parametros):
+        raise OSError(f"No se pudo escribir {ruta}")
+    return [ruta]
+
+
 class GestionImagenes:
-    def __init__(self, volume):
+    def __init__(self, volume, carpeta=None, indice=None, mostrar=True, normalizacion="corte", geometria=None,
+                 reformatos_contiguos=False, memoria_max_reformatos=1024**3):
+        """
+        volume: volumen (cortes, filas, columnas) ya cargado.
+        carpeta: carpeta DICOM de origen; indice: IndiceSerie del cargador (geometría en caché).
+        geometria: Geometria del volumen; por defecto se obtiene del índice (o 1 mm isotrópico).
+        reformatos_contiguos: si es True, la primera vez que se pide un corte coronal o sagital
+                              se guarda una copia traspuesta y contigua del volumen para ese eje,
+                              de modo que esos cortes salen contiguos como los axiales. Las copias
+                              no superan 'memoria_max_reformatos' bytes (se descarta la menos usada).
+        mostrar: si es False (modo sin pantalla) los métodos solo devuelven los arreglos y
+                 matplotlib no llega a importarse. Cada método acepta también 'mostrar'.
+        normalizacion: rango usado al pasar cortes a uint8: 'corte' (mínimo/máximo de cada
+                       corte), 'volumen' (del volumen completo) o 'ventana' (WindowCenter/
+                       WindowWidth del DICOM; si no existen se usa 'volumen').
+        """
+        if normalizacion not in ("corte", "volumen", "ventana"):
+            raise ValueError("Normalización no válida. Usa: 'corte', 'volumen' o 'ventana'.")
         self.volume = volume
+        self.carpeta = carpeta
+        self.indice = indice
+        if geometria is None:
+            geometria = Geometria.desde_indice(indice) if indice is not None else Geometria()
+        self.geometria = geometria
+        self.mostrar = mostrar
+        self.normalizacion = normalizacion
+        self._normalizador = None
+        self._normalizadores_ventana = OrderedDict()  # (centro, ancho) -> Normalizador (con su LUT)
+        self._cortes_visuales = OrderedDict()         # (tipo, índice, ventana) -> corte uint8
+        self._cortes_visuales_de = None
+        self.max_cortes_visuales = 64
+        self._piramides = OrderedDict()               # (tipo, índice, ventana) -> niveles uint8
+        self._piramides_de = None
+        self._histograma = None  # (volumen, centros, conteos), se calcula una sola vez
+        self._remuestreados = OrderedDict()  # espaciado destino -> volumen remuestreado
+        self._remuestreados_de = None
+        self.reformatos_contiguos = reformatos_contiguos
+        self.memoria_max_reformatos = memoria_max_reformatos
+        self._reformatos = OrderedDict()     # tipo -> copia contigua con ese eje primero
+        self._reformatos_de = None
 
     def obtener_corte(self, tipo, indice):
         """Devuelve el corte solicitado según tipo ('axial', 'coronal', 'sagital') e índice."""
         if tipo == "axial":
             return self.volume[indice, :, :]
-        elif tipo == "coronal":
+        elif tipo in ("coronal", "sagital") and self.reformatos_contiguos:
+            reformato = self._reformato(tipo)
+            if reformato is not None:
+                return reformato[indice]
+        if tipo == "coronal":
             return self.volume[:, indice, :]
         elif tipo == "sagital":
             return self.volume[:, :, indice]
         else:
             raise ValueError("Tipo de corte no válido")
 
-    def segmentar(self, corte, tipo_binarizacion):
-        """Aplica segmentación (binarización) según el tipo especificado."""
-        metodos = {
-            "binario": cv2.THRESH_BINARY,
-            "binario_inv": cv2.THRESH_BINARY_INV,
-            "truncado": cv2.THRESH_TRUNC,
-            "tozero": cv2.THRESH_TOZERO,
-            "tozero_inv": cv2.THRESH_TOZERO_INV
-        }
+    def memoria_reformatos(self):
+        """Bytes ocupados por las copias contiguas coronal/sagital guardadas."""
+        return sum(r.nbytes for r in self._reformatos.values())
+
+    def _reformato(self, tipo, cortes_por_bloque=32):
+        """
+        Copia C-contigua del volumen con el eje de 'tipo' primero (coronal: (filas, cortes,
+        columnas); sagital: (columnas, cortes, filas)), creada la primera vez que se usa.
+        Devuelve None si la copia no cabe en memoria_max_reformatos.
+        """
+        if self._reformatos_de is not self.volume:
+            self._reformatos.clear()
+            self._reformatos_de = self.volume
+        if tipo in self._reformatos:
+            self._reformatos.move_to_end(tipo)
+            return self._reformatos[tipo]
+
+        nbytes = int(np.prod(self.volume.shape)) * np.dtype(self.volume.dtype).itemsize
+        if nbytes > self.memoria_max_reformatos:
+            return None
+        # Liberar las copias menos usadas hasta que quepa la nueva
+        while self._reformatos and self.memoria_reformatos() + nbytes > self.memoria_max_reformatos:
+            self._reformatos.popitem(last=False)
+
+        ejes = (1, 0, 2) if tipo == "coronal" else (2, 0, 1)
+        nz, ny, nx = self.volume.shape
+        forma = tuple(self.volume.shape[e] for e in ejes)
+        reformato = np.empty(forma, dtype=self.volume.dtype)
+        # Copia por bloques de cortes: no hace falta tener el volumen original entero en memoria
+        for inicio in range(0, nz, cortes_por_bloque):
+            fin = min(inicio + cortes_por_bloque, nz)
+            bloque = np.asarray(self.volume[inicio:fin])
+            reformato[:, inicio:fin, :] = bloque.transpose(ejes)
+        reformato.flags.writeable = False
+        self._reformatos[tipo] = reformato
+        return reformato
+
+    def histograma(self):
+        """Devuelve (centros, conteos) del histograma del volumen, calculado una vez y cacheado."""
+        if self._histograma is None or self._histograma[0] is not self.volume:
+            self._histograma = (self.volume,) + _histograma_volumen(self.volume)
+        return self._histograma[1], self._histograma[2]
+
+    def umbral_automatico(self, metodo="otsu", percentil=95):
+        """Calcula un umbral para todo el volumen con 'otsu', 'triangulo' o 'percentil'."""
+        if metodo not in METODOS_UMBRAL:
+            raise ValueError(f"Método de umbral no válido. Usa: {', '.join(repr(m) for m in METODOS_UMBRAL)}.")
+        centros, conteos = self.histograma()
+        if metodo == "otsu":
+            return _umbral_otsu(centros, conteos)
+        elif metodo == "triangulo":
+            return _umbral_triangulo(centros, conteos)
+        return _umbral_percentil(centros, conteos, percentil)
+
+    def _resolver_umbral(self, umbral, percentil):
+        """Convierte 'umbral' (número o nombre de método automático) en un valor numérico."""
+        if isinstance(umbral, str):
+            return self.umbral_automatico(umbral.lower(), percentil)
+        return umbral
+
+    def _debe_mostrar(self, mostrar):
+        return self.mostrar if mostrar is None else mostrar
+
+    def normalizador(self):
+        """Normalizador del volumen (por rango global o ventana DICOM), calculado una sola vez."""
+        if self._normalizador is None:
+            if self.normalizacion == "ventana" and self.indice is not None and self.indice.ventana:
+                centro, ancho = self.indice.ventana
+                self._normalizador = Normalizador.desde_ventana(centro, ancho, *self.indice.rescale)
+            else:
+                self._normalizador = Normalizador.desde_volumen(self.volume)
+        return self._normalizador
+
+    def normalizador_ventana(self, centro, ancho):
+        """
+        Normalizador para una ventana/nivel (en unidades reescaladas, p. ej. HU). Su tabla de
+        búsqueda de 65536 entradas se construye una sola vez por ventana y se reutiliza.
+        """
+        clave = (float(centro), float(ancho))
+        if clave in self._normalizadores_ventana:
+            self._normalizadores_ventana.move_to_end(clave)
+            return self._normalizadores_ventana[clave]
+
+        rescale = self.indice.rescale if self.indice is not None else (1.0, 0.0)
+        normalizador = Normalizador.desde_ventana(clave[0], clave[1], *rescale)
+        self._normalizadores_ventana[clave] = normalizador
+        while len(self._normalizadores_ventana) > 8:
+            self._normalizadores_ventana.popitem(last=False)
+        return normalizador
+
+    def obtener_corte_visual(self, tipo, indice, ventana=None):
+        """
+        Devuelve el corte listo para mostrar (uint8). ventana: (centro, ancho) o None para
+        usar el modo de normalización de la instancia. Los cortes ya calculados se guardan
+        en una caché LRU por (tipo, índice, ventana), así que volver a un corte no cuesta nada.
+        """
+        if self._cortes_visuales_de is not self.volume:
+            self._cortes_visuales.clear()
+            self._cortes_visuales_de = self.volume
+
+        clave = (tipo, indice, tuple(ventana) if ventana is not None else None)
+        if clave in self._cortes_visuales:
+            self._cortes_visuales.move_to_end(clave)
+            return self._cortes_visuales[clave]
+
+        corte = self.obtener_corte(tipo, indice)
+        if ventana is not None:
+            visual = self.normalizador_ventana(*ventana)(corte)
+        else:
+            visual = self._a_uint8(corte)
+        visual.flags.writeable = False
 
-        metodo = metodos.get(tipo_binarizacion.lower())
-        if metodo is None:
-            raise ValueError("Tipo de binarización no válido")
+        self._cortes_visuales[clave] = visual
+        while len(self._cortes_visuales) > self.max_cortes_visuales:
+            self._cortes_visuales.popitem(last=False)
+        return visual
 
-        umbral, segmentada = cv2.threshold(corte, 100, 255, metodo)
+    def _a_uint8(self, corte):
+        """Pasa un corte del volumen a uint8 según el modo de normalización configurado."""
+        if self.normalizacion == "corte":
+            return normalizar_uint8(corte)
+        return self.normalizador()(corte)
 
-        plt.figure(figsize=(8, 4))
-        plt.subplot(1, 2, 1)
-        plt.imshow(corte, cmap='gray')
-        plt.title("Original")
-        plt.axis('off')
+    def segmentar(self, corte, tipo_binarizacion, umbral=100, percentil=95, nombre_archivo=None, mostrar=None):
+        """
+        Aplica segmentación (binarización) según el tipo especificado.
+        umbral: valor fijo o 'otsu'/'triangulo'/'percentil' (calculado sobre el histograma del volumen).
+        """
+        metodo = _metodo_binarizacion(tipo_binarizacion)
+
+        umbral = self._resolver_umbral(umbral, percentil)
+        with _span("segmentacion", corte.nbytes):
+            umbral, segmentada = cv2.threshold(corte, umbral, 255, metodo)
 
-        plt.subplot(1, 2, 2)
-        plt.imshow(segmentada, cmap='gray')
-        plt.title(f"Segmentada ({tipo_binarizacion})")
-        plt.axis('off')
+        if self._debe_mostrar(mostrar):
+            mostrar_imagenes([(corte, "Original"),
+                              (segmentada, f"Segmentada ({tipo_binarizacion})")], figsize=(8, 4))
 
-        plt.show()
+        if nombre_archivo:
+            _guardar_imagen(f"{nombre_archivo}.png", segmentada)
+            print(f"Imagen segmentada guardada como {nombre_archivo}.png")
 
         return segmentada
+
+    def segmentar_volumen(self, tipo_binarizacion, umbral=100, tipo_corte=None,
+                          workers=None, cortes_por_bloque=32, percentil=95):
+        """
+        Segmenta el volumen completo sin abrir ventanas y devuelve el volumen de máscara.
+
+        tipo_binarizacion: uno de los cinco tipos de METODOS_BINARIZACION.
+        umbral: valor fijo o 'otsu'/'triangulo'/'percentil' (ver umbral_automatico).
+        tipo_corte: None devuelve la máscara con la forma del volumen; 'axial', 'coronal'
+                    o 'sagital' la devuelve con ese eje primero (máscara[i] == corte i).
+        workers: si es > 1 los bloques de cortes se umbralizan en un pool de hilos
+                 (OpenCV libera el GIL).
+        """
+        metodo = _metodo_binarizacion(tipo_binarizacion)
+        if tipo_corte is not None and tipo_corte not in EJES_CORTE:
+            raise ValueError("Tipo de corte no válido")
+        umbral = self._resolver_umbral(umbral, percentil)
+
+        n = self.volume.shape[0]
+        mascara = np.empty(self.volume.shape, dtype=self.volume.dtype)
+        bloques = [(i, min(i + cortes_por_bloque, n)) for i in range(0, n, cortes_por_bloque)]
+
+        def _segmentar_bloque(bloque):
+            inicio, fin = bloque
+            with _span("segmentacion", mascara[inicio:fin].nbytes):
+                mascara[inicio:fin] = _umbralizar(self.volume[inicio:fin], umbral, 255, metodo)
+
+        if workers and workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(_segmentar_bloque, bloques))
+        else:
+            for bloque in bloques:
+                _segmentar_bloque(bloque)
+
+        if tipo_corte is not None:
+            mascara = np.moveaxis(mascara, EJES_CORTE[tipo_corte], 0)
+        return mascara
     
-    def zoom_y_recorte(self, pixel_spacing=(1, 1), slice_thickness=1, nombre_archivo=None):
-        """Realiza un zoom sobre el corte central, dibuja el cuadro y guarda el recorte."""
-        corte = self.volume[self.volume.shape[0] // 2, :, :]
+    def volumen_remuestreado(self, nuevo_espaciado, workers=None):
+        """Volumen remuestreado al espaciado dado (mm); se calcula una vez y queda en caché."""
+        if self._remuestreados_de is not self.volume:
+            self._remuestreados.clear()
+            self._remuestreados_de = self.volume
+        clave = tuple(float(e) for e in nuevo_espaciado)
+        if clave in self._remuestreados:
+            self._remuestreados.move_to_end(clave)
+            return self._remuestreados[clave]
+
+        volumen = remuestrear_volumen(self.volume, self.geometria.espaciado, clave, workers=workers)
+        self._remuestreados[clave] = volumen
+        while len(self._remuestreados) > 2:
+            self._remuestreados.popitem(last=False)
+        return volumen
+
+    def volumen_isotropico(self, espaciado=None, workers=None):
+        """Volumen con vóxeles cúbicos (por defecto del menor espaciado del volumen)."""
+        espaciado = espaciado or min(self.geometria.espaciado)
+        return self.volumen_remuestreado((espaciado,) * 3, workers)
+
+    def obtener_reformato(self, tipo, indice):
+        """
+        Corte con píxeles cuadrados: en coronal y sagital se remuestrea solo el eje z al
+        espaciado del eje horizontal del corte (el volumen remuestreado queda en caché).
+        """
+        if tipo == "axial":
+            return self.obtener_corte(tipo, indice)
+        dz, fila, columna = self.geometria.espaciado
+        destino = columna if tipo == "coronal" else fila
+        volumen = self.volumen_remuestreado((destino, fila, columna))
+        if tipo == "coronal":
+            return volumen[:, indice, :]
+        elif tipo == "sagital":
+            return volumen[:, :, indice]
+        else:
+            raise ValueError("Tipo de corte no válido")
+
+    def _caja_en_pixeles(self, tipo, caja, unidades, forma):
+        """Convierte (x, y, ancho, alto) en píxeles o mm a una caja en píxeles dentro del corte."""
+        x, y, ancho, alto = caja
+        if unidades == "mm":
+            mm_fila, mm_columna = self.geometria.espaciado_corte(tipo)
+            x, ancho = x / mm_columna, ancho / mm_columna
+            y, alto = y / mm_fila, alto / mm_fila
+        elif unidades != "px":
+            raise ValueError("Unidades no válidas. Usa: 'px' o 'mm'.")
+
+        h, w = forma[:2]
+        x0, y0 = max(0, int(round(x))), max(0, int(round(y)))
+        x1, y1 = min(w, int(round(x + ancho))), min(h, int(round(y + alto)))
+        if x1 <= x0 or y1 <= y0:
+            raise ValueError("La región de interés queda fuera del corte.")
+        return x0, y0, x1 - x0, y1 - y0
+
+    def piramide(self, tipo, indice, niveles=1, ventana=None):
+        """
+        Pirámide multirresolución (uint8) del corte: nivel 0 = corte visual, cada nivel
+        siguiente a la mitad con cv2.pyrDown. Se guarda en caché y solo se calculan los
+        niveles que se van pidiendo.
+        """
+        if self._piramides_de is not self.volume:
+            self._piramides.clear()
+            self._piramides_de = self.volume
+        clave = (tipo, indice, tuple(ventana) if ventana is not None else None)
+        if clave in self._piramides:
+            self._piramides.move_to_end(clave)
+        else:
+            self._piramides[clave] = [self.obtener_corte_visual(tipo, indice, ventana)]
+            while len(self._piramides) > 8:
+                self._piramides.popitem(last=False)
 
-        img_norm = ((corte - np.min(corte)) / (np.max(corte) - np.min(corte)) * 255).astype(np.uint8)
-        img_bgr = cv2.cvtColor(img_norm, cv2.COLOR_GRAY2BGR)
+        lista = self._piramides[clave]
+        while len(lista) < niveles and min(lista[-1].shape[:2]) >= 2:
+            lista.append(cv2.pyrDown(lista[-1]))
+        return lista
 
-        h, w = img_bgr.shape[:2]
-        x, y, ancho, alto = w // 4, h // 4, w // 2, h // 2
+    def recortar_roi(self, tipo, indice, caja, unidades="px", tamano_salida=None, ventana=None,
+                     interpolacion=cv2.INTER_CUBIC, nombre_archivo=None):
+        """
+        Recorta una región de interés de cualquier corte y la lleva a 'tamano_salida'.
+
+        caja: (x, y, ancho, alto) en 'px' o en 'mm' (con el PixelSpacing/SliceThickness reales).
+        tamano_salida: (ancho, alto) del resultado; por defecto el tamaño de la caja.
+        Al reducir, el recorte se toma del nivel de la pirámide más cercano (ya calculado y
+        en caché) en lugar de remuestrear el corte completo cada vez.
+        """
+        base = self.obtener_corte_visual(tipo, indice, ventana)
+        x, y, ancho, alto = self._caja_en_pixeles(tipo, caja, unidades, base.shape)
+        salida_w, salida_h = tamano_salida if tamano_salida is not None else (ancho, alto)
+        factor = min(salida_w / ancho, salida_h / alto)
+
+        # Nivel de pirámide: el más reducido que siga teniendo al menos la resolución pedida
+        nivel = 0
+        while factor * 2 ** (nivel + 1) <= 1 and min(ancho, alto) >> (nivel + 1) >= 1:
+            nivel += 1
+        niveles = self.piramide(tipo, indice, nivel + 1, ventana)
+        nivel = min(nivel, len(niveles) - 1)
+        fuente = niveles[nivel]
+        escala = 2 ** nivel
+        recorte = fuente[y // escala:max(y // escala + 1, (y + alto) // escala),
+                         x // escala:max(x // escala + 1, (x + ancho) // escala)]
+
+        if recorte.shape[:2] == (salida_h, salida_w):
+            resultado = recorte.copy()
+        else:
+            metodo = interpolacion if factor * escala >= 1 else cv2.INTER_AREA
+            with _span("redimension", recorte.nbytes):
+                resultado = cv2.resize(recorte, (salida_w, salida_h), interpolation=metodo)
+
+        if nombre_archivo:
+            _guardar_imagen(f"{nombre_archivo}.png", resultado)
+            print(f"Imagen recortada guardada como {nombre_archivo}.png")
+        return resultado
+
+    def zoom_y_recorte(self, pixel_spacing=None, slice_thickness=None, nombre_archivo=None, mostrar=None,
+                       tipo="axial", indice=None, caja=None, unidades="px"):
+        """
+        Realiza un zoom sobre un corte (por defecto el axial central), dibuja el cuadro y guarda el recorte.
+        caja: (x, y, ancho, alto) en 'px' o 'mm'; por defecto el cuarto central del corte.
+        pixel_spacing/slice_thickness: por defecto se usan los reales de la geometría del volumen.
+        """
+        if pixel_spacing is None:
+            mm_fila, mm_columna = self.geometria.espaciado_corte(tipo)
+            pixel_spacing = (mm_columna, mm_fila)
+        if slice_thickness is None:
+            slice_thickness = self.geometria.espesor
 
-        cv2.rectangle(img_bgr, (x, y), (x + ancho, y + alto), (0, 255, 255), 2)
+        if indice is None:
+            indice = self.volume.shape[EJES_CORTE[tipo]] // 2
+        img_norm = self.obtener_corte_visual(tipo, indice)
 
-        dim_x_mm = ancho * pixel_spacing[0]
-        dim_y_mm = alto * pixel_spacing[1]
-        texto = f"{dim_x_mm:.1f}mm x {dim_y_mm:.1f}mm, Espesor: {slice_thickness}mm"
-        cv2.putText(img_bgr, texto, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0,255,255), 2)
+        h, w = img_norm.shape[:2]
+        if caja is None:
+            caja, unidades = (w // 4, h // 4, w // 2, h // 2), "px"
+        x, y, ancho, alto = self._caja_en_pixeles(tipo, caja, unidades, img_norm.shape)
 
-        recorte = img_norm[y:y+alto, x:x+ancho]
-        recorte_zoom = cv2.resize(recorte, (w, h), interpolation=cv2.INTER_CUBIC)
+        recorte_zoom = self.recortar_roi(tipo, indice, (x, y, ancho, alto), tamano_salida=(w, h))
 
-        fig, axs = plt.subplots(1, 2, figsize=(10, 5))
-        axs[0].imshow(cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB))
-        axs[0].set_title("Corte original con cuadro")
-        axs[0].axis('off')
+        if self._debe_mostrar(mostrar):
+            # El cuadro y el texto solo se dibujan para la visualización
+            img_bgr = cv2.cvtColor(img_norm, cv2.COLOR_GRAY2BGR)
+            cv2.rectangle(img_bgr, (x, y), (x + ancho, y + alto), (0, 255, 255), 2)
 
-        axs[1].imshow(recorte_zoom, cmap='gray')
-        axs[1].set_title("Recorte con zoom")
-        axs[1].axis('off')
+            dim_x_mm = ancho * pixel_spacing[0]
+            dim_y_mm = alto * pixel_spacing[1]
+            texto = f"{dim_x_mm:.1f}mm x {dim_y_mm:.1f}mm, Espesor: {slice_thickness}mm"
+            cv2.putText(img_bgr, texto, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0,255,255), 2)
 
-        plt.tight_layout()
-        plt.show()
+            mostrar_imagenes([(cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB), "Corte original con cuadro"),
+                              (recorte_zoom, "Recorte con zoom")], figsize=(10, 5))
 
         # Guardar si se proporciona un nombre
         if nombre_archivo:
-            cv2.imwrite(f"{nombre_archivo}.png", recorte_zoom)
+            _guardar_imagen(f"{nombre_archivo}.png", recorte_zoom)
             print(f"Imagen recortada guardada como {nombre_archivo}.png")
 
         return recorte_zoom
     
-    def aplicar_morfologia(self, imagen, operacion, kernel_size=3, nombre_salida=None):
+    def aplicar_morfologia(self, imagen, operacion, kernel_size=3, nombre_salida=None, mostrar=None):
         """Aplica una transformación morfológica a la imagen dada."""
     
         if imagen.dtype != np.uint8:
-            imagen = ((imagen - np.min(imagen)) / (np.max(imagen) - np.min(imagen)) * 255).astype(np.uint8)
+            imagen = normalizar_uint8(imagen)
     
         # Crear kernel morfológico
         kernel = np.ones((kernel_size, kernel_size), np.uint8)
     
         # Aplicar la operación correspondiente
-        if operacion == 'erode':
-            resultado = cv2.erode(imagen, kernel, iterations=1)
-        elif operacion == 'dilate':
-            resultado = cv2.dilate(imagen, kernel, iterations=1)
-        elif operacion == 'open':
-            resultado = cv2.morphologyEx(imagen, cv2.MORPH_OPEN, kernel)
-        elif operacion == 'close':
-            resultado = cv2.morphologyEx(imagen, cv2.MORPH_CLOSE, kernel)
-        else:
-            raise ValueError("Operación morfológica no válida. Usa: 'erode', 'dilate', 'open' o 'close'.")
+        with _span("morfologia", imagen.nbytes):
+            if operacion == 'erode':
+                resultado = cv2.erode(imagen, kernel, iterations=1)
+            elif operacion == 'dilate':
+                resultado = cv2.dilate(imagen, kernel, iterations=1)
+            elif operacion == 'open':
+                resultado = cv2.morphologyEx(imagen, cv2.MORPH_OPEN, kernel)
+            elif operacion == 'close':
+                resultado = cv2.morphologyEx(imagen, cv2.MORPH_CLOSE, kernel)
+            else:
+                raise ValueError("Operación morfológica no válida. Usa: 'erode', 'dilate', 'open' o 'close'.")
     
         # Mostrar el resultado
-        plt.imshow(resultado, cmap='gray')
-        plt.title(f"aplicar_morfologia: {operacion}")
-        plt.axis('off')
-        plt.show()
+        if self._debe_mostrar(mostrar):
+            mostrar_imagenes([(resultado, f"aplicar_morfologia: {operacion}")])
     
-        # Guardar la imagen resultante
-        if nombre_salida is None:
-            nombre_salida = f"morfologia_{operacion}.png"
-        cv2.imwrite(nombre_salida, resultado)
-        print(f"Imagen morfológica guardada como {nombre_salida}")
+        # Guardar la imagen resultante si se proporciona un nombre
+        if nombre_salida:
+            _guardar_imagen(nombre_salida, resultado)
+            print(f"Imagen morfológica guardada como {nombre_salida}")
     
         return resultado
 
-def zoom_y_recorte(volume, pixel_spacing=(1,1), slice_thickness=1):
-    """
-    Realiza un 'zoom' en el corte central del volumen, dibuja un cuadro de recorte,
-    normaliza, redimensiona y muestra ambas imágenes con OpenCV.
-    """
-    # Seleccionar el corte central
-    corte = volume[volume.shape[0] // 2, :, :]
-
-    #Normalización a uint8 según la fórmula dada
-    img_norm = ((corte - np.min(corte)) / (np.max(corte) - np.min(corte)) * 255).astype(np.uint8)
-
-    # Convertir a BGR para dibujar colores
-    img_bgr = cv2.cvtColor(img_norm, cv2.COLOR_GRAY2BGR)
-
-    # Definir región de interés (ROI) para el recorte
-    h, w = img_bgr.shape[:2]
-    x, y, ancho, alto = w // 4, h // 4, w // 2, h // 2  # recorte central
-
-    # Dibujar el cuadro amarillo sobre la imagen original
-    cv2.rectangle(img_bgr, (x, y), (x + ancho, y + alto), (0, 255, 255), 2)
-
-    # Calcular dimensiones físicas en mm (usando pixelSpacing y SliceThickness)
-    dim_x_mm = ancho * pixel_spacing[0]
-    dim_y_mm = alto * pixel_spacing[1]
-    texto = f"{dim_x_mm:.1f}mm x {dim_y_mm:.1f}mm, Espesor: {slice_thickness}mm"
-
-    # Escribir el texto sobre la imagen
-    cv2.putText(img_bgr, texto, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0,255,255), 2)
-
-    #Recorte de la región seleccionada
-    recorte = img_norm[y:y+alto, x:x+ancho]
-
-    #Redimensionar el recorte (zoom)
-    recorte_zoom = cv2.resize(recorte, (w, h), interpolation=cv2.INTER_CUBIC)
-
-    #Mostrar ambas imágenes con matplotlib
-    fig, axs = plt.subplots(1, 2, figsize=(10, 5))
-    axs[0].imshow(cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB))
-    axs[0].title("Corte original con cuadro")
-    axs[0].axis('off')
-
-    axs[1].imshow(recorte_zoom, cmap='gray')
-    axs[1].set_title("Recorte con zoom")
-    axs[1].axis('off')
-
-    plt.tight_layout()
-    plt.show()
-
-    # Guardar el recorte zoom como archivo PNG
-    nombre = input("Ingrese el nombre para guardar la imagen recortada: ")
-    cv2.imwrite(f"{nombre}.png", recorte_zoom)
-    print(f"Imagen recortada guardada como {nombre}.png")
-
-def transformacion_morfologica(self, tipo_corte, indice, operacion, kernel_size=3, nombre_archivo=None):
+    def transformacion_morfologica(self, tipo_corte, indice, operacion, kernel_size=3, nombre_archivo=None, mostrar=None):
         """
         Aplica una transformación morfológica (erode, dilate, open, close)
         sobre un corte del volumen, normaliza a uint8, muestra y guarda el resultado.
@@ -279,85 +2624,283 @@ def transformacion_morfologica(self, tipo_corte, indice, operacion, kernel_size=
         corte = self.obtener_corte(tipo_corte, indice)
 
         # Normalizar a uint8 para OpenCV
-        img_uint8 = ((corte - np.min(corte)) / (np.max(corte) - np.min(corte)) * 255).astype(np.uint8)
+        img_uint8 = self._a_uint8(corte)
 
         # Crear kernel cuadrado del tamaño indicado
         kernel = np.ones((kernel_size, kernel_size), np.uint8)
 
         # Elegir la operación
-        if operacion == "erode":
-            resultado = cv2.erode(img_uint8, kernel, iterations=1)
-        elif operacion == "dilate":
-            resultado = cv2.dilate(img_uint8, kernel, iterations=1)
-        elif operacion == "open":
-            resultado = cv2.morphologyEx(img_uint8, cv2.MORPH_OPEN, kernel)
-        elif operacion == "close":
-            resultado = cv2.morphologyEx(img_uint8, cv2.MORPH_CLOSE, kernel)
-        else:
-            raise ValueError("Operación morfológica no válida. Usa: 'erode', 'dilate', 'open' o 'close'.")
+        with _span("morfologia", img_uint8.nbytes):
+            if operacion == "erode":
+                resultado = cv2.erode(img_uint8, kernel, iterations=1)
+            elif operacion == "dilate":
+                resultado = cv2.dilate(img_uint8, kernel, iterations=1)
+            elif operacion == "open":
+                resultado = cv2.morphologyEx(img_uint8, cv2.MORPH_OPEN, kernel)
+            elif operacion == "close":
+                resultado = cv2.morphologyEx(img_uint8, cv2.MORPH_CLOSE, kernel)
+            else:
+                raise ValueError("Operación morfológica no válida. Usa: 'erode', 'dilate', 'open' o 'close'.")
 
         # Mostrar imagen resultante
-        plt.figure(figsize=(8, 4))
-        plt.subplot(1, 2, 1)
-        plt.imshow(img_uint8, cmap='gray')
-        plt.title("Corte original")
-        plt.axis('off')
-
-        plt.subplot(1, 2, 2)
-        plt.imshow(resultado, cmap='gray')
-        plt.title(f"Transformación: {operacion} (kernel={kernel_size})")
-        plt.axis('off')
-        plt.show()
+        if self._debe_mostrar(mostrar):
+            mostrar_imagenes([(img_uint8, "Corte original"),
+                              (resultado, f"Transformación: {operacion} (kernel={kernel_size})")], figsize=(8, 4))
 
         # Guardar imagen
-      
-        cv2.imwrite(f"{nombre_archivo}.png", resultado)
-        print(f"Imagen guardada como {nombre_archivo}.png")
+        if nombre_archivo:
+            _guardar_imagen(f"{nombre_archivo}.png", resultado)
+            print(f"Imagen guardada como {nombre_archivo}.png")
 
         return resultado
 
-def convertir_a_nifti(carpeta_dicom, nombre_salida="resultado.nii"):
+    def morfologia_volumen(self, operacion, kernel_size=3, forma="cubo", workers=None):
+        """Aplica una transformación morfológica 3D a todo el volumen (ver morfologia_3d)."""
+        return morfologia_3d(self.volume, operacion, kernel_size, forma, workers)
+
+    def exportar_cortes(self, carpeta, tipo="axial", indices=None, volumen=None, formato="png",
+                        compresion=3, workers=None, prefijo="corte", bits=8, columnas=None):
+        """
+        Exporta cortes de 'volumen' (p. ej. el resultado de segmentar_volumen o de
+        morfologia_volumen; por defecto el volumen cargado) con exportar_cortes().
+        El volumen cargado se normaliza con el mismo criterio que la visualización.
+        """
+        normalizador = None
+        if volumen is None:
+            volumen = self.volume
+            if volumen.dtype != np.uint8 and bits == 8:
+                normalizador = self.normalizador()
+        return exportar_cortes(volumen, carpeta, tipo, indices, formato, compresion, workers,
+                               prefijo, normalizador, bits, columnas)
+
+    def componentes_conexas(self, mascara, conectividad=26, workers=None):
+        """
+        Etiqueta las componentes conexas 3D de una máscara (p. ej. de segmentar_volumen) y
+        calcula sus estadísticas con el espaciado real y las intensidades del volumen.
+        """
+        return ComponentesConexas(mascara, conectividad, self.geometria.espaciado,
+                                  intensidades=self.volume, workers=workers)
+
+    def convertir_a_nifti(self, nombre_salida="resultado.nii"):
+        """Exporta el volumen ya cargado a NIfTI usando la geometría del índice (sin releer los píxeles)."""
+        if self.indice is None:
+            if self.carpeta is None:
+                raise ValueError("Se necesita la carpeta DICOM o su IndiceSerie para exportar a NIfTI.")
+            self.indice = IndiceSerie(self.carpeta)
+        return convertir_a_nifti(self.carpeta, nombre_salida, indice=self.indice, volumen=self.volume)
+
+
+def zoom_y_recorte(volume, pixel_spacing=(1,1), slice_thickness=1, mostrar=True):
+    """
+    Realiza un 'zoom' en el corte central del volumen, dibuja un cuadro de recorte,
+    normaliza, redimensiona y muestra ambas imágenes con OpenCV.
+    """
+    recorte_zoom = GestionImagenes(volume, mostrar=mostrar).zoom_y_recorte(pixel_spacing, slice_thickness)
+
+    # Guardar el recorte zoom como archivo PNG
+    nombre = input("Ingrese el nombre para guardar la imagen recortada: ")
+    _guardar_imagen(f"{nombre}.png", recorte_zoom)
+    print(f"Imagen recortada guardada como {nombre}.png")
+    return recorte_zoom
+
+def _volumen_nifti(volume, orden):
+    """
+    Reordena un volumen (cortes, filas, columnas) según 'orden' y lo expone como
+    (filas, columnas, cortes). Si el orden es el mismo o el inverso no se copia nada.
+    """
+    n = len(orden)
+    if orden == list(range(n)):
+        ordenado = volume
+    elif orden == list(range(n - 1, -1, -1)):
+        ordenado = volume[::-1]
+    else:
+        ordenado = volume[orden]
+    return np.moveaxis(ordenado, 0, -1)
+
+
+def _affine_nifti(indice):
+    """
+    Matriz de afinidad (orientación espacial) a partir de la geometría del índice: el eje z
+    usa la distancia real entre cortes (ImagePositionPatient), no SliceThickness.
+    """
+    #Espaciado (z, filas, columnas) con sus valores por defecto por eje si faltan etiquetas
+    dz, fila, columna = Geometria.desde_indice(indice).espaciado
+    return np.diag([fila, columna, dz, 1])
+
+
+def convertir_a_nifti(carpeta_dicom, nombre_salida="resultado.nii", indice=None, volumen=None):
     """
     Convierte una carpeta con archivos DICOM a formato NIfTI (.nii).
     
     Parámetros:
         carpeta_dicom (str): ruta a la carpeta que contiene los archivos DICOM
         nombre_salida (str): nombre del archivo .nii de salida
+        indice (IndiceSerie): índice de cabeceras ya construido (opcional, evita releerlas)
+        volumen (ndarray): volumen ya cargado con DicomLoader en el orden de 'indice'
+            (opcional, evita decodificar de nuevo la serie)
     """
-    #Leer todos los archivos DICOM de la carpeta
-    archivos = [os.path.join(carpeta_dicom, f) for f in os.listdir(carpeta_dicom) if f.endswith(".dcm")]
-    if not archivos:
-        print("No se encontraron archivos DICOM en la carpeta.")
-        return
+    #Construir (o reutilizar) el índice de cabeceras de la carpeta
+    if indice is None:
+        try:
+            indice = IndiceSerie(carpeta_dicom)
+        except ValueError:
+            print("No se encontraron archivos DICOM en la carpeta.")
+            return
+
+    #Ordenar los cortes por su posición en el eje Z
+    orden = indice.orden_por_posicion()
+
+    if volumen is not None:
+        #Reutilizar el volumen en memoria: solo se reordenan los ejes (sin copia en series ordenadas)
+        volumen = _volumen_nifti(volumen, orden)
+    else:
+        #Reservar el volumen 3D (orden Fortran: cada corte queda contiguo) y llenarlo corte a corte
+        archivos = [indice.rutas[i] for i in orden]
+        volumen = np.empty(indice.forma + (len(archivos),), dtype=indice.dtype, order="F")
+        for i, archivo in enumerate(archivos):
+            _colocar_corte(volumen[..., i], _decodificar_corte(archivo, indice.decodificador))
 
-    #Cargar las imágenes y ordenarlas por su posición en el eje Z
-    slices = [pydicom.dcmread(a) for a in archivos]
-    slices.sort(key=lambda s: float(s.ImagePositionPatient[2]) if "ImagePositionPatient" in s else 0)
+    #Crear el objeto NIfTI
+    nifti_img = nib.Nifti1Image(volumen, _affine_nifti(indice))
 
-    #Crear un volumen 3D con los píxeles de cada corte
-    volumen = np.stack([s.pixel_array for s in slices], axis=-1)
+    #Guardar el archivo
+    with _span("escritura_nifti", volumen.nbytes):
+        nib.save(nifti_img, nombre_salida)
+    print(f"Conversión completada. Archivo guardado como: {nombre_salida}")
 
-    #Extraer el tamaño de píxel y el espesor del corte (si están disponibles)
-    try:
-        pixel_spacing = slices[0].PixelSpacing
-        slice_thickness = float(slices[0].SliceThickness)
-    except:
-        pixel_spacing = [1.0, 1.0]
-        slice_thickness = 1.0
 
-    # Crear la matriz de afinidad (define la orientación espacial del volumen)
-    affine = np.diag([pixel_spacing[0], pixel_spacing[1], slice_thickness, 1])
+class EscritorNiftiStreaming:
+    """
+    Escribe un archivo NIfTI (.nii o .nii.gz) corte a corte sin tener el volumen en memoria.
 
-    #Crear el objeto NIfTI
-    nifti_img = nib.Nifti1Image(volumen, affine)
+    La cabecera se escribe al abrir y luego cada corte (filas, columnas) se agrega en el
+    orden de NIfTI (Fortran), agrupado en bloques de 'cortes_por_bloque'. Con .nii.gz cada
+    bloque se comprime como un miembro gzip independiente en un pool de hilos, de modo
+    que la memoria usada es de unos pocos bloques sin importar el tamaño de la serie.
+    """
 
-    #Guardar el archivo
-    nib.save(nifti_img, nombre_salida)
-    print(f"Conversión completada. Archivo guardado como: {nombre_salida}")
- 
-  
+    def __init__(self, ruta, forma_corte, n_cortes, dtype, affine,
+                 cortes_por_bloque=8, workers=None, nivel_compresion=6):
+        self.ruta = ruta
+        self.forma_corte = tuple(forma_corte)
+        self.n_cortes = n_cortes
+        self.dtype = np.dtype(dtype).newbyteorder("<")
+        self.cortes_por_bloque = cortes_por_bloque
+        self.nivel_compresion = nivel_compresion
+        self.comprimir = ruta.endswith(".gz")
+        self.escritos = 0
+
+        self._bloque = []
+        self._pendientes = deque()
+        self._max_pendientes = 2 * (workers or os.cpu_count() or 1)
+        self._pool = ThreadPoolExecutor(max_workers=workers) if self.comprimir else None
+        self._archivo = open(ruta, "wb")
+
+        cabecera = nib.Nifti1Header()
+        cabecera.set_data_dtype(self.dtype)
+        cabecera.set_data_shape(self.forma_corte + (n_cortes,))
+        cabecera.set_sform(affine, code="aligned")
+        cabecera.set_qform(affine, code="unknown")
+        cabecera["vox_offset"] = 352  # 348 bytes de cabecera + 4 del indicador de extensiones
+        self._cabecera = cabecera.binaryblock + b"\x00" * 4
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        # Si hubo un error dentro del bloque se descarta el archivo parcial y se deja
+        # propagar la excepción original en lugar del error de cortes faltantes
+        if tipo is not None:
+            self.abortar()
+        else:
+            self.cerrar()
+
+    def _comprimir(self, datos):
+        """Comprime un bloque como un miembro gzip completo (zlib libera el GIL)."""
+        compresor = zlib.compressobj(self.nivel_compresion, zlib.DEFLATED, 31)
+        return compresor.compress(datos) + compresor.flush()
+
+    def _emitir(self, datos):
+        """Escribe (o encola para comprimir) un bloque de bytes respetando el orden."""
+        if not self.comprimir:
+            self._archivo.write(datos)
+            return
+        self._pendientes.append(self._pool.submit(self._comprimir, datos))
+        while len(self._pendientes) > self._max_pendientes:
+            self._archivo.write(self._pendientes.popleft().result())
+
+    def escribir(self, corte):
+        """Agrega el siguiente corte (filas, columnas) al archivo."""
+        if self.escritos >= self.n_cortes:
+            raise ValueError("Se escribieron más cortes de los declarados en la cabecera.")
+        if corte.shape != self.forma_corte:
+            raise ValueError(f"Forma de corte no válida: {corte.shape}, se esperaba {self.forma_corte}.")
+
+        # En NIfTI el primer eje (filas) varía más rápido: orden Fortran del corte
+        self._bloque.append(np.asarray(corte, dtype=self.dtype).tobytes(order="F"))
+        self.escritos += 1
+        if len(self._bloque) >= self.cortes_por_bloque:
+            self._vaciar_bloque()
+
+    def _vaciar_bloque(self):
+        datos = b"".join(self._bloque)
+        self._bloque = []
+        if self._cabecera is not None:
+            datos = self._cabecera + datos
+            self._cabecera = None
+        with _span("escritura_nifti", len(datos)):
+            self._emitir(datos)
+
+    def cerrar(self):
+        """Escribe lo pendiente y cierra el archivo."""
+        if self._archivo is None:
+            return
+        try:
+            if self._bloque or self._cabecera is not None:
+                self._vaciar_bloque()
+            while self._pendientes:
+                self._archivo.write(self._pendientes.popleft().result())
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+            self._archivo.close()
+            self._archivo = None
+
+        if self.escritos != self.n_cortes:
+            raise ValueError(f"Se escribieron {self.escritos} de {self.n_cortes} cortes.")
+
+    def abortar(self):
+        """Cierra el archivo sin escribir lo pendiente y elimina la salida parcial."""
+        if self._archivo is None:
+            return
+        for futuro in self._pendientes:
+            futuro.cancel()
+        self._pendientes.clear()
+        self._bloque = []
+        if self._pool is not None:
+            self._pool.shutdown()
+        self._archivo.close()
+        self._archivo = None
+        try:
+            os.remove(self.ruta)
+        except OSError:
+            pass
 
 
+def convertir_a_nifti_streaming(carpeta_dicom, nombre_salida="resultado.nii", indice=None,
+                                cortes_por_bloque=8, workers=None, nivel_compresion=6):
+    """
+    Igual que convertir_a_nifti pero decodificando y escribiendo corte a corte:
+    la memoria usada no depende del tamaño de la serie. Con nombre_salida terminado
+    en .nii.gz la compresión se hace en paralelo.
+    """
+    if indice is None:
+        indice = IndiceSerie(carpeta_dicom)
 
+    with EscritorNiftiStreaming(nombre_salida, indice.forma, len(indice), indice.dtype,
+                                _affine_nifti(indice), cortes_por_bloque, workers,
+                                nivel_compresion) as escritor:
+        for i in indice.orden_por_posicion():
+            escritor.escribir(_decodificar_corte(indice.rutas[i], indice.decodificador))
 
-       
+    print(f"Conversión completada. Archivo guardado como: {nombre_salida}")
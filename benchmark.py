@@ -0,0 +1,214 @@
+"""
+Benchmarks de las rutas críticas: carga DICOM, obtención de cortes, segmentación,
+morfología y exportación NIfTI.
+
+Genera localmente una serie DICOM sintética del tamaño pedido (no descarga datos),
+mide cada etapa y reporta tiempo, rendimiento (cortes/s y MB/s) y pico de memoria.
+Con --json el resultado se guarda en un archivo para comparar corridas en el tiempo.
+
+Ejemplo:
+    python benchmark.py --cortes 256 --filas 256 --columnas 256 --repeticiones 3 --json bench.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, MRImageStorage, generate_uid
+
+import Implemementacion
+
+
+def generar_serie_sintetica(carpeta, cortes=64, filas=256, columnas=256, semilla=0):
+    """Escribe una serie MR sintética de 16 bits (una esfera con ruido) en 'carpeta'."""
+    os.makedirs(carpeta, exist_ok=True)
+    rng = np.random.default_rng(semilla)
+    study_uid, series_uid = generate_uid(), generate_uid()
+
+    _, y, x = np.ogrid[:cortes, :filas, :columnas]
+    radio = min(cortes, filas, columnas) / 3
+
+    # Los archivos se escriben en orden aleatorio para que la carga tenga que ordenarlos
+    for n, i in enumerate(rng.permutation(cortes)):
+        distancia = np.sqrt((i - cortes / 2) ** 2 + (y - filas / 2) ** 2 + (x - columnas / 2) ** 2)
+        corte = np.where(distancia < radio, 2000, 300) + rng.normal(0, 50, (filas, columnas))
+        corte = np.clip(corte, 0, 4095).astype(np.uint16)
+
+        meta = FileMetaDataset()
+        meta.MediaStorageSOPClassUID = MRImageStorage
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+        ds = Dataset()
+        ds.file_meta = meta
+        ds.SOPClassUID = MRImageStorage
+        ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+        ds.StudyInstanceUID = study_uid
+        ds.SeriesInstanceUID = series_uid
+        ds.Modality = "MR"
+        ds.StudyDate = "20250101"
+        ds.StudyTime = "100000"
+        ds.SeriesTime = "100500"
+        ds.StudyDescription = "Serie sintética de benchmark"
+        ds.InstanceNumber = int(i) + 1
+        ds.ImagePositionPatient = [0.0, 0.0, float(i)]
+        ds.PixelSpacing = [1.0, 1.0]
+        ds.SliceThickness = 1.0
+        ds.Rows, ds.Columns = filas, columnas
+        ds.BitsAllocated, ds.BitsStored, ds.HighBit = 16, 12, 11
+        ds.PixelRepresentation = 0
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = "MONOCHROME2"
+        ds.PixelData = corte.tobytes()
+        ds.save_as(os.path.join(carpeta, f"corte_{n:04d}.dcm"), enforce_file_format=True)
+
+
+def medir(etapa, funcion, cortes, nbytes, repeticiones):
+    """Ejecuta 'funcion' varias veces y devuelve tiempos, rendimiento y pico de memoria."""
+    tiempos = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            funcion()
+            tiempos.append(time.perf_counter() - inicio)
+
+        # Corrida aparte con tracemalloc para no sesgar los tiempos
+        tracemalloc.start()
+        funcion()
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    mejor = min(tiempos)
+    return {
+        "etapa": etapa,
+        "tiempo_min_s": mejor,
+        "tiempo_medio_s": statistics.mean(tiempos),
+        "cortes_por_s": cortes / mejor if mejor > 0 else None,
+        "mb_por_s": nbytes / 1e6 / mejor if mejor > 0 else None,
+        "pico_memoria_mb": pico / 1e6,
+    }
+
+
+def ejecutar(carpeta, repeticiones=3, workers=4, salida_tmp=None, latencia_ms=0.0):
+    """
+    Corre todas las etapas sobre la serie de 'carpeta' y devuelve la lista de resultados.
+    latencia_ms: latencia simulada por archivo para la carga asíncrona (almacenamiento en red).
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        loader = Implemementacion.DicomLoader(carpeta)
+        volumen = loader.load()
+    gestor = Implemementacion.GestionImagenes(volumen, carpeta, loader.indice, mostrar=False)
+    nz, ny, nx = volumen.shape
+    nbytes = volumen.nbytes
+    mascara = gestor.segmentar_volumen("binario", "otsu")
+    salida_tmp = salida_tmp or tempfile.mkdtemp(prefix="bench_salida_")
+
+    def carga_async():
+        with Implemementacion.LectorArchivos(latencia=latencia_ms / 1000) as lector:
+            asyncio.run(Implemementacion.DicomLoader(carpeta, workers=workers).load_async(lector=lector))
+
+    def recorrer(tipo, n):
+        def _recorrer():
+            for i in range(n):
+                np.ascontiguousarray(gestor.obtener_corte(tipo, i))
+        return _recorrer
+
+    etapas = [
+        ("carga_serial", lambda: Implemementacion.DicomLoader(carpeta).load(), nz, nbytes),
+        (f"carga_paralela_{workers}_hilos",
+         lambda: Implemementacion.DicomLoader(carpeta, workers=workers).load(), nz, nbytes),
+        (f"carga_async_latencia_{latencia_ms:g}ms", carga_async, nz, nbytes),
+        ("corte_axial", recorrer("axial", nz), nz, nbytes),
+        ("corte_coronal", recorrer("coronal", ny), ny, nbytes),
+        ("corte_sagital", recorrer("sagital", nx), nx, nbytes),
+        ("segmentar_corte", lambda: gestor.segmentar(gestor.obtener_corte("axial", nz // 2), "binario"),
+         1, nbytes // nz),
+        ("segmentar_volumen", lambda: gestor.segmentar_volumen("binario", workers=workers), nz, nbytes),
+        ("segmentar_volumen_otsu", lambda: gestor.segmentar_volumen("binario", "otsu", workers=workers),
+         nz, nbytes),
+        ("componentes_26", lambda: gestor.componentes_conexas(mascara, 26, workers), nz, nbytes),
+        ("morfologia_corte", lambda: gestor.transformacion_morfologica("axial", nz // 2, "open", 5),
+         1, nbytes // nz),
+        ("morfologia_3d_cubo", lambda: gestor.morfologia_volumen("open", 5, "cubo", workers), nz, nbytes),
+        ("morfologia_3d_bola", lambda: gestor.morfologia_volumen("open", 5, "bola", workers), nz, nbytes),
+        ("exportar_png", lambda: gestor.exportar_cortes(os.path.join(salida_tmp, "png"), volumen=mascara,
+                                                        workers=workers), nz, nbytes),
+        ("nifti_desde_volumen",
+         lambda: gestor.convertir_a_nifti(os.path.join(salida_tmp, "bench.nii")), nz, nbytes),
+        ("nifti_streaming_gz",
+         lambda: Implemementacion.convertir_a_nifti_streaming(
+             carpeta, os.path.join(salida_tmp, "bench.nii.gz"), loader.indice, workers=workers),
+         nz, nbytes),
+    ]
+
+    resultados = []
+    for etapa, funcion, cortes, n in etapas:
+        resultado = medir(etapa, funcion, cortes, n, repeticiones)
+        resultados.append(resultado)
+        print(f"{etapa:<28} {resultado['tiempo_min_s'] * 1e3:10.2f} ms "
+              f"{resultado['cortes_por_s'] or 0:10.1f} cortes/s {resultado['mb_por_s'] or 0:10.1f} MB/s "
+              f"pico {resultado['pico_memoria_mb']:8.1f} MB")
+
+    shutil.rmtree(salida_tmp, ignore_errors=True)
+    return resultados
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de carga y procesamiento DICOM.")
+    parser.add_argument("--cortes", type=int, default=64)
+    parser.add_argument("--filas", type=int, default=256)
+    parser.add_argument("--columnas", type=int, default=256)
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=4, help="Hilos para las variantes paralelas")
+    parser.add_argument("--latencia-ms", type=float, default=0.0,
+                        help="Latencia simulada por archivo en la carga asíncrona")
+    parser.add_argument("--carpeta", help="Usar esta serie DICOM en lugar de generar una sintética")
+    parser.add_argument("--json", help="Guardar los resultados en este archivo JSON")
+    args = parser.parse_args(argv)
+
+    temporal = None
+    carpeta = args.carpeta
+    if carpeta is None:
+        temporal = tempfile.mkdtemp(prefix="bench_dicom_")
+        carpeta = temporal
+        print(f"Generando serie sintética {args.cortes}x{args.filas}x{args.columnas} en {carpeta}...")
+        generar_serie_sintetica(carpeta, args.cortes, args.filas, args.columnas)
+
+    try:
+        resultados = ejecutar(carpeta, args.repeticiones, args.workers, latencia_ms=args.latencia_ms)
+    finally:
+        if temporal:
+            shutil.rmtree(temporal, ignore_errors=True)
+
+    if args.json:
+        reporte = {
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "plataforma": platform.platform(),
+            "python": platform.python_version(),
+            "versiones": {"numpy": np.__version__, "pydicom": pydicom.__version__,
+                          "opencv": Implemementacion.cv2.__version__},
+            "parametros": vars(args),
+            "resultados": resultados,
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reporte, f, indent=2, ensure_ascii=False)
+        print(f"Resultados guardados en {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,16 +6,16 @@ def main():
     carpeta = input("Ingrese la ruta de la carpeta DICOM: ").strip()
     # Limpia espacios o saltos de línea del input
 
-    # Crear el cargador
-    loader = Implemementacion.DicomLoader(carpeta)
+    # Crear el cargador (con caché en disco: reabrir un estudio no vuelve a decodificarlo)
+    loader = Implemementacion.DicomLoader(carpeta, cache=Implemementacion.CacheVolumenes())
     volumen = loader.load()
     loader.mostrar_cortes()
 
     # Crear el estudio
-    estudio = Implemementacion.EstudioImaginologico(carpeta, volumen)
+    estudio = Implemementacion.EstudioImaginologico(carpeta, volumen, loader.indice)
 
     # Crear el gestor de imágenes
-    gestor = Implemementacion.GestionImagenes(volumen, carpeta)
+    gestor = Implemementacion.GestionImagenes(volumen, carpeta, loader.indice)
 
     # Registrar objetos
     gestor_objetos = Implemementacion.GestorObjetos()
@@ -45,7 +45,7 @@ def main():
             tipo_bin = input("Tipo de binarización (binario/binario_inv/truncado/tozero/tozero_inv): ")
             nombre = input("Nombre para guardar el archivo: ")
             corte = gestor.obtener_corte(tipo, indice)
-            gestor.segmentar(corte, tipo_bin, nombre)
+            gestor.segmentar(corte, tipo_bin, nombre_archivo=nombre)
 
         elif opcion == "3":
             tipo = input("Tipo de corte (transversal(x)/coronal(y)/sagital(z)): ")
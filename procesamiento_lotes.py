@@ -0,0 +1,252 @@
+"""
+Procesamiento por lotes (sin menú ni ventanas) de muchas series DICOM.
+
+Recorre un árbol de carpetas (o un manifiesto con una carpeta por línea), toma
+cada carpeta con archivos .dcm como una serie y le aplica el mismo pipeline,
+procesando varias series a la vez en un pool de procesos.
+
+Ejemplo:
+    python procesamiento_lotes.py datos/PPMI --salida resultados --procesos 4 \
+        --pipeline "segmentar:binario:otsu,morfologia:open:3:bola,recorte,nifti"
+
+Pasos del pipeline (separados por comas, argumentos separados por ':'):
+    segmentar[:tipo[:umbral]]                  tipo de binarización y umbral (número u otsu/triangulo/percentil)
+    morfologia[:operacion[:kernel[:forma]]]    erode/dilate/open/close, tamaño y forma (cubo/bola/cruz)
+    recorte                                    guarda el recorte con zoom del corte central (PNG)
+    nifti                                      exporta el volumen actual a NIfTI
+    exportar[:formato[:tipo]]                  exporta todos los cortes del volumen actual
+                                               (png/jpg/tiff/mosaico; axial/coronal/sagital)
+La carga de la serie siempre es el primer paso.
+
+Con --instrumentar cada serie guarda además <salida>/<serie>_instrumentacion.json con el
+tiempo, los bytes y (con 'memoria') el pico de memoria de cada etapa: cabeceras,
+decodificación, apilado, segmentación, morfología, redimensionado y escrituras.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import Implemementacion
+
+
+PASOS = ("segmentar", "morfologia", "recorte", "nifti", "exportar")
+
+
+def parsear_pipeline(spec):
+    """Convierte 'paso:arg:arg,paso,...' en una lista de (paso, [args])."""
+    pasos = []
+    for parte in spec.split(","):
+        parte = parte.strip()
+        if not parte:
+            continue
+        nombre, *args = parte.split(":")
+        if nombre not in PASOS:
+            raise ValueError(f"Paso de pipeline no válido: '{nombre}'. Usa: {', '.join(PASOS)}.")
+        pasos.append((nombre, args))
+    return pasos
+
+
+def buscar_series(raiz):
+    """Devuelve las carpetas del árbol que contienen al menos un archivo .dcm."""
+    series = []
+    for carpeta, _, archivos in os.walk(raiz):
+        if any(f.lower().endswith(".dcm") for f in archivos):
+            series.append(carpeta)
+    return sorted(series)
+
+
+def leer_manifiesto(ruta):
+    """Lee un manifiesto de texto con una carpeta de serie por línea ('#' para comentarios)."""
+    with open(ruta, encoding="utf-8") as f:
+        return [l.strip() for l in f if l.strip() and not l.strip().startswith("#")]
+
+
+def _limitar_memoria(memoria_max_mb):
+    """Inicializador de cada proceso: limita su espacio de direcciones (solo en sistemas POSIX)."""
+    if not memoria_max_mb:
+        return
+    try:
+        import resource
+    except ImportError:
+        print("Aviso: el límite de memoria por proceso no está disponible en este sistema.")
+        return
+    limite = int(memoria_max_mb) * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limite, limite))
+
+
+def _umbral(valor):
+    try:
+        return float(valor)
+    except ValueError:
+        return valor
+
+
+def procesar_serie(carpeta, pasos, salida, hilos=None, nombre=None, instrumentar=None):
+    """
+    Carga una serie y le aplica los pasos del pipeline; devuelve un reporte con los tiempos.
+    instrumentar: None, 'tiempo' o 'memoria'; agrega al reporte el detalle por etapa.
+    """
+    nombre = nombre or os.path.basename(os.path.normpath(carpeta))
+    base = os.path.join(salida, nombre)
+    reporte = {"serie": carpeta, "salida": base, "estado": "ok", "tiempos": {}, "forma": None, "error": None}
+    inicio_total = time.perf_counter()
+
+    instrumentacion = None
+    if instrumentar:
+        instrumentacion = Implemementacion.Instrumentacion(memoria=instrumentar == "memoria")
+        with instrumentacion.activar():
+            _ejecutar_pipeline(carpeta, pasos, salida, base, hilos, reporte)
+    else:
+        _ejecutar_pipeline(carpeta, pasos, salida, base, hilos, reporte)
+
+    reporte["tiempos"]["total"] = time.perf_counter() - inicio_total
+    if instrumentacion is not None:
+        reporte["instrumentacion"] = instrumentacion.reporte()
+        if os.path.isdir(salida):
+            instrumentacion.guardar_json(f"{base}_instrumentacion.json")
+    return reporte
+
+
+def _ejecutar_pipeline(carpeta, pasos, salida, base, hilos, reporte):
+    """Carga la serie y ejecuta los pasos, anotando tiempos y errores en 'reporte'."""
+    try:
+        os.makedirs(salida, exist_ok=True)
+
+        t = time.perf_counter()
+        loader = Implemementacion.DicomLoader(carpeta, workers=hilos)
+        volumen = loader.load()
+        reporte["tiempos"]["carga"] = time.perf_counter() - t
+        reporte["forma"] = list(volumen.shape)
+
+        for i, (paso, args) in enumerate(pasos):
+            t = time.perf_counter()
+            gestor = Implemementacion.GestionImagenes(volumen, carpeta, loader.indice, mostrar=False)
+
+            if paso == "segmentar":
+                tipo = args[0] if len(args) > 0 else "binario"
+                umbral = _umbral(args[1]) if len(args) > 1 else 100
+                volumen = gestor.segmentar_volumen(tipo, umbral, workers=hilos)
+            elif paso == "morfologia":
+                operacion = args[0] if len(args) > 0 else "open"
+                kernel = int(args[1]) if len(args) > 1 else 3
+                forma = args[2] if len(args) > 2 else "cubo"
+                volumen = gestor.morfologia_volumen(operacion, kernel, forma, workers=hilos)
+            elif paso == "recorte":
+                gestor.zoom_y_recorte(nombre_archivo=f"{base}_recorte")
+            elif paso == "nifti":
+                gestor.convertir_a_nifti(f"{base}.nii")
+            elif paso == "exportar":
+                formato = args[0] if len(args) > 0 else "png"
+                tipo = args[1] if len(args) > 1 else "axial"
+                gestor.exportar_cortes(f"{base}_cortes", tipo, volumen=volumen, formato=formato,
+                                       compresion=90 if formato == "jpg" else 1, workers=hilos)
+
+            reporte["tiempos"][f"{i + 1}_{paso}"] = time.perf_counter() - t
+    except Exception as e:
+        reporte["estado"] = "error"
+        reporte["error"] = f"{type(e).__name__}: {e}"
+
+
+def _nombre_serie(carpeta, raiz):
+    """Nombre de salida a partir de la ruta de la serie relativa a 'raiz'."""
+    relativa = os.path.relpath(carpeta, raiz) if raiz else os.path.basename(os.path.normpath(carpeta))
+    if relativa in (".", ""):
+        relativa = os.path.basename(os.path.normpath(carpeta))
+    return relativa.replace(os.sep, "_").replace("/", "_")
+
+
+def _imprimir_reporte(reporte):
+    tiempos = ", ".join(f"{k}={v:.2f}s" for k, v in reporte["tiempos"].items())
+    if reporte["estado"] == "ok":
+        print(f"[ok]    {reporte['serie']} {tuple(reporte['forma'])}: {tiempos}")
+    else:
+        print(f"[error] {reporte['serie']}: {reporte['error']} ({tiempos})")
+
+
+def procesar_lote(series, pasos, salida, procesos=1, hilos=None, memoria_max_mb=None, raiz=None,
+                  instrumentar=None):
+    """
+    Procesa todas las series (en paralelo si procesos > 1) y devuelve la lista de reportes.
+    raiz: carpeta de la que se toman las rutas relativas para nombrar las salidas; sin ella
+          (p. ej. con un manifiesto) se usa la ruta común de todas las series.
+    """
+    if raiz is None and len(series) > 1:
+        raiz = os.path.commonpath([os.path.abspath(c) for c in series])
+    nombres = {}
+    for carpeta in series:
+        nombre = _nombre_serie(carpeta, raiz)
+        if nombre in nombres:
+            raise ValueError(f"Las series '{nombres[nombre]}' y '{carpeta}' escribirían en la misma "
+                             f"salida '{nombre}'.")
+        nombres[nombre] = carpeta
+
+    reportes = []
+    if procesos and procesos > 1:
+        with ProcessPoolExecutor(max_workers=procesos, initializer=_limitar_memoria,
+                                 initargs=(memoria_max_mb,)) as pool:
+            futuros = [pool.submit(procesar_serie, c, pasos, salida, hilos, n, instrumentar)
+                       for n, c in nombres.items()]
+            for futuro in as_completed(futuros):
+                reporte = futuro.result()
+                _imprimir_reporte(reporte)
+                reportes.append(reporte)
+    else:
+        for nombre, carpeta in nombres.items():
+            reporte = procesar_serie(carpeta, pasos, salida, hilos, nombre, instrumentar)
+            _imprimir_reporte(reporte)
+            reportes.append(reporte)
+    return reportes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Procesamiento por lotes de series DICOM.")
+    parser.add_argument("raiz", nargs="?", help="Carpeta raíz con una o varias series DICOM")
+    parser.add_argument("--manifiesto", help="Archivo de texto con una carpeta de serie por línea")
+    parser.add_argument("--pipeline", default="segmentar,nifti",
+                        help="Pasos separados por comas (ver la documentación del módulo)")
+    parser.add_argument("--salida", default="resultados", help="Carpeta de salida")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count() or 1,
+                        help="Series procesadas en paralelo")
+    parser.add_argument("--hilos", type=int, default=None, help="Hilos por serie (carga y procesamiento)")
+    parser.add_argument("--memoria-max-mb", type=int, default=None, help="Límite de memoria por proceso")
+    parser.add_argument("--reporte", help="Ruta del reporte JSON con los tiempos por serie")
+    parser.add_argument("--instrumentar", choices=("tiempo", "memoria"),
+                        help="Guardar el detalle por etapa de cada serie (con 'memoria' mide también el pico)")
+    args = parser.parse_args(argv)
+
+    if not args.raiz and not args.manifiesto:
+        parser.error("Indique una carpeta raíz o un --manifiesto.")
+
+    try:
+        pasos = parsear_pipeline(args.pipeline)
+    except ValueError as e:
+        parser.error(str(e))
+    series = leer_manifiesto(args.manifiesto) if args.manifiesto else buscar_series(args.raiz)
+    if not series:
+        print("No se encontraron series DICOM.")
+        return 1
+
+    print(f"Procesando {len(series)} series con {args.procesos} procesos...")
+    inicio = time.perf_counter()
+    try:
+        reportes = procesar_lote(series, pasos, args.salida, args.procesos, args.hilos,
+                                 args.memoria_max_mb, raiz=args.raiz, instrumentar=args.instrumentar)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    errores = sum(r["estado"] != "ok" for r in reportes)
+    print(f"Terminado en {time.perf_counter() - inicio:.2f}s: {len(reportes) - errores} ok, {errores} con error.")
+
+    if args.reporte:
+        with open(args.reporte, "w", encoding="utf-8") as f:
+            json.dump(reportes, f, indent=2, ensure_ascii=False)
+        print(f"Reporte guardado en {args.reporte}")
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())